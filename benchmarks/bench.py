@@ -0,0 +1,212 @@
+"""
+Benchmarks of milton's hot paths: building notes, mixing, writing,
+reading and playing (against the capture backend, no synth needed).
+Workloads are modeled on tests/piano_phase.py and tests/spectral_canon.py.
+
+    python benchmarks/bench.py --size medium --save baseline.json
+    python benchmarks/bench.py --size medium --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from math import log2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import numpy as np
+import milton
+
+
+# total notes of each workload size
+SIZES = {"small": 1_000, "medium": 10_000, "large": 100_000}
+# how many seconds the (time compressed) playback benchmark lasts
+PLAY_SECS = {"small": 0.5, "medium": 1, "large": 2}
+PHASING_TROPE = (64, 66, 71, 73, 74, 66, 64, 73, 71, 66, 74, 73)
+# seconds importing milton for writing/reading may take (see --import-budget)
+IMPORT_BUDGET = 0.25
+REALTIME_MODULES = ("asyncio", "rtmidi", "milton.realtime", "milton.sender", "milton.backend")
+
+
+def piano_phase(n, make=milton.make_note):
+    """Two voices of n/2 notes each, the second slowly phasing
+    against the first."""
+    rate = milton.rhy_to_sec(1/24, 72)
+    half = n // 2
+    v1 = [make(PHASING_TROPE[i % 12], onset=rate * i, dur=rate * 1.5, vel=100, chnl=1)
+          for i in range(half)]
+    v2 = [make(PHASING_TROPE[i % 12], onset=rate * i * 0.99, dur=rate * 1.5, vel=100, chnl=2)
+          for i in range(half)]
+    return [v1, v2]
+
+def piano_phase_blocks(n):
+    rate = milton.rhy_to_sec(1/24, 72)
+    idx = np.arange(n // 2)
+    pchs = np.take(PHASING_TROPE, idx % 12)
+    return [milton.make_notes(pchs, idx * rate, rate * 1.5, 1, 100),
+            milton.make_notes(pchs, idx * rate * 0.99, rate * 1.5, 2, 100)]
+
+def spectral_canon(n, voices=24):
+    """voices voices of harmonics (microtonal key numbers) entering
+    one after another, every voice accelerating logarithmically."""
+    k = 4 / log2(9 / 8)
+    per_voice = n // voices
+    vcs = []
+    for v in range(voices):
+        onset = k * log2(v + 1) * 0.01
+        knum = milton.hz_to_knum(55 * (v + 1))
+        vc = []
+        for j in range(1, per_voice + 1):
+            dur = k * log2((8 + j) / (7 + j)) * 0.01
+            vc.append(milton.make_note(knum, onset=onset, dur=dur, chnl=v % 16 + 1))
+            onset += dur
+        vcs.append(vc)
+    return vcs
+
+def chords(n):
+    return [[milton.make_chord((60 + i % 12, 64 + i % 12, 67 + i % 12), onset=i * 0.01, dur=0.01)
+             for i in range(n // 3)]]
+
+
+def _measure(fn, repeat):
+    """Returns the best time of repeat runs and the peak memory
+    (in bytes) of the first run."""
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best, peak
+
+def _stretch(events, secs):
+    """Returns a copy of the note voices compressed to last secs."""
+    end = max(nt["onset"] + nt["dur"] for vc in events for nt in vc)
+    return [[dict(nt, onset=nt["onset"] * secs / end, dur=nt["dur"] * secs / end)
+             for nt in vc] for vc in events]
+
+def bench_play(events, secs):
+    be = milton.realtime.init("capture")
+    tele = milton.telemetry.Telemetry(milton.realtime.client_ports(), size=2 * SIZES["large"] + 16,
+                                      synths=milton.realtime.client_synths())
+    t = time.perf_counter()
+    asyncio.run(milton.realtime.play(_stretch(events, secs), False, telemetry=tele))
+    wall = time.perf_counter() - t
+    rep = tele.report()
+    return {"seconds": wall, "overrun": wall - secs, "messages": len(be),
+            "p50": rep["latency"]["p50"], "p99": rep["latency"]["p99"],
+            "max_lateness": rep["max_lateness"]}
+
+def import_time(repeat=5):
+    """Returns the best wall time of importing milton (with the writer
+    and the reader) in a fresh interpreter, and which modules of the
+    realtime stack got loaded by it (none should)."""
+    code = ("import sys, time; sys.path.insert(0, %r); t = time.perf_counter(); "
+            "import milton, milton.writer, milton.reader; print(time.perf_counter() - t); "
+            "print(*[m for m in %r if m in sys.modules])") % (
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"), REALTIME_MODULES)
+    best, loaded = float("inf"), []
+    for _ in range(repeat):
+        secs, loaded = subprocess.check_output([sys.executable, "-c", code], text=True).split("\n", 1)
+        best = min(best, float(secs))
+    return best, loaded.split()
+
+
+def run(size, repeat=3):
+    n = SIZES[size]
+    results = dict()
+    def record(name, fn, count):
+        try:
+            secs, peak = _measure(fn, repeat)
+            results[name] = {"seconds": secs, "per_sec": count / secs, "peak_bytes": peak}
+        except Exception as e: # keep benchmarking the rest
+            results[name] = {"error": repr(e)}
+    # enough channels for the microtones of every canon voice
+    milton.cfg.port_count = 4
+    milton.realtime.init("capture")
+    record("make_note", lambda: piano_phase(n), n)
+    record("make_note_microtonal", lambda: spectral_canon(n), n)
+    record("make_chord", lambda: chords(n), n)
+    record("make_notes", lambda: piano_phase_blocks(n), n)
+    notes = piano_phase(n)
+    blocks = piano_phase_blocks(n)
+    record("mix", lambda: list(milton.mix(notes)), n)
+    record("mix_blocks", lambda: milton.mix(blocks), n)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.mid")
+        record("save", lambda: milton.writer.save(notes, path), n)
+        # without the compile cache's hits (see cache.py)
+        record("save_cold", lambda: (milton.writer._chunks.clear(), milton.writer.save(notes, path)), n)
+        record("save_blocks", lambda: milton.writer.save(blocks, path), n)
+        record("parse", lambda: milton.reader.parse(path), n)
+    try:
+        results["play"] = bench_play(notes, PLAY_SECS[size])
+        results["play_microtonal"] = bench_play(spectral_canon(n), PLAY_SECS[size])
+    except Exception as e:
+        results["play"] = {"error": repr(e)}
+    secs, loaded = import_time()
+    results["import"] = {"seconds": secs, "loaded": loaded}
+    return {
+        "size": size, "notes": n,
+        "python": platform.python_version(), "numpy": np.__version__,
+        "machine": platform.machine(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(new, old, tolerance):
+    """Prints the change of every timing against the baseline and
+    returns the names of those slower by more than tolerance."""
+    slower = []
+    for name, res in new["results"].items():
+        base = old["results"].get(name, {})
+        if "seconds" not in res or "seconds" not in base:
+            continue
+        ratio = res["seconds"] / base["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            flag = "  <-- regression"
+        print(f"{name:24} {base['seconds']:10.4f}s -> {res['seconds']:10.4f}s  x{ratio:.2f}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results as a JSON baseline to this path")
+    parser.add_argument("--compare", help="compare the results against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (default 0.25)")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET,
+                        help=f"allowed seconds of importing milton (default {IMPORT_BUDGET})")
+    args = parser.parse_args()
+    res = run(args.size, args.repeat)
+    print(json.dumps(res, indent=2))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(res, f, indent=2)
+    failed = False
+    if args.compare:
+        with open(args.compare) as f:
+            failed = bool(compare(res, json.load(f), args.tolerance))
+    imp = res["results"]["import"]
+    if imp["seconds"] > args.import_budget or imp["loaded"]:
+        print(f"import took {imp['seconds']:.4f}s (budget {args.import_budget}s), "
+              f"loaded {imp['loaded'] or 'nothing'} of the realtime stack")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
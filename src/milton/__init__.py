@@ -1,31 +1,84 @@
-import __main__
-import asyncio
-import milton.realtime
-import milton.writer
-import milton.reader
-from datetime import datetime
+import sys
+import importlib
 from .utils import *
 
+# submodules and names imported on first use, so that writing
+# (or reading) midi files never loads the realtime stack
+_LAZY_MODULES = {
+    "cfg", "err", "seq", "realtime", "writer", "reader", "telemetry",
+    "backend", "sender", "alloc", "cache", "score", "transform", "timeline",
+    "tempo", "itree",
+}
+_LAZY_NAMES = {
+    "Score": "score", "Pipe": "transform",
+    "Session": "realtime", "PlaybackHandle": "realtime",
+    "TempoMap": "tempo",
+}
 
-try:
-    from __main__ import __file__ # running a python script.py?
-    _SCRIPT = True
-except ImportError: # running from shell
-    _SCRIPT = False
 
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        return importlib.import_module(f"milton.{name}")
+    if name in _LAZY_NAMES:
+        return getattr(importlib.import_module(f"milton.{_LAZY_NAMES[name]}"), name)
+    raise AttributeError(f"module 'milton' has no attribute {name!r}")
 
-def proc(events, mid="", opt=False):
-    """Processes every thing!
-    Set opt to True to listen first and decide to write to the disk or not afterwards."""
+
+def _running_script():
+    """Returns true if running a python script.py (not from a shell)."""
+    return hasattr(sys.modules["__main__"], "__file__")
+
+
+def proc(events, mid="", opt=False, telemetry=False, start=0, end=None, loop=False, tempo=None):
+    """Processes every thing! events can also be a Score.
+    Set opt to True to listen first and decide to write to the disk or not afterwards.
+    Set telemetry to True to get a report of the playback's timing accuracy
+    back, or to a path to also dump the report there as JSON.
+    start, end and loop select (and repeat) the region to play, see
+    realtime.play. tempo is the tempo map of the written midi file,
+    see writer.save."""
+    from datetime import datetime
+    import milton.writer as writer
     if mid: # write to a midi file
-        writer.save(events, mid)
+        writer.save(events, mid, tempo)
         print(f"Saved {mid} at {datetime.now()}")
-    else: # play now
-        if opt:
-            asyncio.run(realtime.play(events, _SCRIPT))
-            mid_path = input("Spec path ( without suffix ) to save\n")
-            if mid_path:
-                writer.save(events, mid_path + ".mid")
-                print(f"Wrote to {mid_path}.mid at {datetime.now()}")
-        else:
-            asyncio.run(realtime.play(events, _SCRIPT))
+        return
+    import asyncio
+    import milton.realtime as realtime
+    import milton.telemetry
+    import milton.timeline
+    # compile once for playing and saving (async streams can only be played)
+    if opt and not (start or end is not None or loop) and not realtime._is_async(events):
+        events = milton.timeline.compile(events)
+    session = realtime._get_session()
+    tele = milton.telemetry.Telemetry(session.client_ports(), synths=session.client_synths()) if telemetry else None
+    try:
+        asyncio.run(realtime.play(events, _running_script(), telemetry=tele, start=start, end=end, loop=loop,
+                                  session=session))
+    except KeyboardInterrupt: # stopped, the notes are turned off by play
+        pass
+    if opt:
+        mid_path = input("Spec path ( without suffix ) to save\n")
+        if mid_path:
+            writer.save(events, mid_path + ".mid", tempo)
+            print(f"Wrote to {mid_path}.mid at {datetime.now()}")
+    if tele:
+        if isinstance(telemetry, str):
+            tele.dump(telemetry)
+        return tele.report()
+
+
+async def aplay(events, telemetry=False, start=0, end=None, loop=False, session=None):
+    """Plays the events like proc, but as a coroutine to be awaited
+    inside a running event loop (Jupyter, async apps). The ports stay
+    open afterwards. For adding events while playing see
+    PlaybackHandle."""
+    import milton.realtime as realtime
+    import milton.telemetry
+    session = session or realtime._get_session()
+    tele = milton.telemetry.Telemetry(session.client_ports(), synths=session.client_synths()) if telemetry else None
+    await realtime.play(events, False, telemetry=tele, start=start, end=end, loop=loop, session=session)
+    if tele:
+        if isinstance(telemetry, str):
+            tele.dump(telemetry)
+        return tele.report()
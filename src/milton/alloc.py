@@ -0,0 +1,69 @@
+"""
+Allocating midi channels to notes while they are sounding
+"""
+import heapq
+import milton.err
+
+
+class ChnlAllocator:
+    """Hands out the channels 0 to count-1 to sounding notes.
+    A microtone needs a channel for itself (it's pitch bend would
+    detune everything else on that channel), equal-tempered notes
+    can share channels with each other. Acquiring and releasing
+    never scan the channels."""
+
+    def __init__(self, count):
+        self.count = count
+        # channel: [references, status]
+        # status True: in-use by a microtone, False: in-use by
+        # equal-tempered notes, None: free
+        self.usage = [[0, None] for _ in range(count)]
+        # heap of free channels, a channel taken directly (not popped)
+        # stays in the heap and is skipped when it comes up
+        self._free = list(range(count))
+        self._in_heap = [True] * count
+        # channels in-use by equal-tempered notes (dict as ordered set)
+        self._eqtemp = dict()
+
+    def _pop_free(self):
+        while self._free:
+            chnl = heapq.heappop(self._free)
+            self._in_heap[chnl] = False
+            if self.usage[chnl][1] is None:
+                return chnl
+        raise milton.err.NoFreeChnlErr()
+
+    def acquire_micton(self, chnl):
+        """Returns chnl if no other note is using it, otherwise
+        the next free channel."""
+        if self.usage[chnl][1] is not None:
+            chnl = self._pop_free()
+        self.usage[chnl] = [1, True]
+        return chnl
+
+    def acquire_eqtemp(self, chnl):
+        """Returns chnl if it is free or in-use by equal-tempered
+        notes only, otherwise another channel with equal-tempered
+        notes or the next free channel."""
+        if self.usage[chnl][1] is True:
+            chnl = next(iter(self._eqtemp)) if self._eqtemp else self._pop_free()
+        self.usage[chnl][0] += 1
+        self.usage[chnl][1] = False
+        self._eqtemp[chnl] = None
+        return chnl
+
+    def release(self, chnl):
+        """Drops one reference to chnl, freeing it if it was the last."""
+        stat = self.usage[chnl]
+        stat[0] -= 1
+        if stat[0] == 0:
+            stat[1] = None
+            self._eqtemp.pop(chnl, None)
+            if not self._in_heap[chnl]:
+                heapq.heappush(self._free, chnl)
+                self._in_heap[chnl] = True
+
+    def occupancy(self):
+        """Returns {channel: (references, status)} of the channels in-use."""
+        return {chnl: tuple(stat) for chnl, stat in enumerate(self.usage)
+                if stat[1] is not None}
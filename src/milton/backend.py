@@ -0,0 +1,116 @@
+"""
+Midi output backends. A backend opens one client per synth and port,
+a client is anything with a send_message(message) method.
+"""
+import time
+import struct
+import numpy as np
+import milton.cfg
+
+
+class Backend:
+    """Interface of the midi output backends."""
+
+    def open(self, synth, port):
+        """Returns a new client sending to the port-th port of the synth."""
+        raise NotImplementedError
+
+    def close(self):
+        """Closes all clients opened by this backend."""
+        pass
+
+
+def _get_api(api):
+    import rtmidi
+    return {
+        "unspec": rtmidi.API_UNSPECIFIED,
+        "core": rtmidi.API_MACOSX_CORE,
+        "alsa": rtmidi.API_LINUX_ALSA,
+        "jack": rtmidi.API_UNIX_JACK,
+        "win": rtmidi.API_WINDOWS_MM,
+        "dummy": rtmidi.API_RTMIDI_DUMMY
+    }[api]
+
+
+class RtMidiBackend(Backend):
+    """Sends to the ports (of the api cfg.api) whose names contain
+    the synth name."""
+
+    def __init__(self):
+        import rtmidi
+        self._rtmidi = rtmidi
+        self.api = _get_api(milton.cfg.api)
+        # save a list of available ports
+        tmp_client = rtmidi.MidiOut(rtapi=self.api)
+        self.available_ports = [p.lower() for p in tmp_client.get_ports()]
+        tmp_client.delete()
+        self.clients = []
+
+    def open(self, synth, port):
+        # hopefuly ports are listed in right order by get_ports!!!
+        synth_port_idxs = [i for i, p in enumerate(self.available_ports) if synth.lower() in p]
+        client = self._rtmidi.MidiOut(name=f"Milton Client {synth}", rtapi=self.api)
+        client.open_port(synth_port_idxs[port], f"Output Port")
+        self.clients.append(client)
+        return client
+
+    def close(self):
+        for client in self.clients:
+            client.close_port()
+            client.delete()
+        self.clients = []
+
+
+class CaptureClient:
+    def __init__(self, sink, synth, port):
+        self.sink = sink
+        self.synth = synth
+        self.port = port
+
+    def send_message(self, msg):
+        self.sink.capture(self.synth, self.port, msg)
+
+
+class CaptureBackend(Backend):
+    """Keeps every message in memory instead of sending it, as records
+    of (time.monotonic() time, synth index, port, message length,
+    message bytes) packed into one bytearray. Good for measuring and
+    testing playback without any midi hardware or synth."""
+
+    RECORD = struct.Struct("<dBBB3s")
+    DTYPE = np.dtype([("time", "<f8"), ("synth", "u1"), ("port", "u1"),
+                      ("len", "u1"), ("msg", "u1", 3)])
+
+    def __init__(self):
+        self.synths = []
+        self.data = bytearray()
+
+    def open(self, synth, port):
+        if synth not in self.synths:
+            self.synths.append(synth)
+        return CaptureClient(self, self.synths.index(synth), port)
+
+    def capture(self, synth, port, msg):
+        self.data += self.RECORD.pack(time.monotonic(), synth, port, len(msg), bytes(msg))
+
+    def __len__(self):
+        return len(self.data) // self.RECORD.size
+
+    def records(self):
+        """Returns the captured messages as a numpy structured array
+        with the fields time, synth, port, len and msg (a copy, the
+        capturing goes on)."""
+        return np.frombuffer(bytes(self.data), dtype=self.DTYPE)
+
+    def clear(self):
+        self.data = bytearray()
+
+
+_BACKENDS = {"rtmidi": RtMidiBackend, "capture": CaptureBackend}
+
+def get_backend(backend):
+    """Returns backend if it is a Backend, otherwise a new backend
+    of the name (one of rtmidi, capture)."""
+    if isinstance(backend, Backend):
+        return backend
+    return _BACKENDS[backend]()
@@ -0,0 +1,69 @@
+"""
+Caching what is compiled from voices (realtime notes, midi track
+chunks), so that processing the same score again only compiles the
+voices which have changed.
+"""
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import milton.cfg
+from milton.utils import _voice_to_block
+
+
+class LRU:
+    """A mapping keeping the size most recently used items (size
+    defaults to cfg.compile_cache_size)."""
+
+    def __init__(self, size=None):
+        self.size = size or milton.cfg.compile_cache_size
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        try:
+            val = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return val
+
+    def put(self, key, val):
+        self.items[key] = val
+        self.items.move_to_end(key)
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+
+_BLOCK_COLS = ("onset", "dur", "knum", "vel", "chnl")
+
+def block_key(blk):
+    """Returns a hash of the note data of the block."""
+    h = hashlib.blake2b(digest_size=16)
+    for k in _BLOCK_COLS:
+        col = np.ascontiguousarray(blk[k])
+        h.update(col.dtype.str.encode())
+        h.update(col.tobytes())
+    return h.hexdigest()
+
+
+def compiled(cache, vc, compile, extra=None):
+    """Returns compile(block) of the voice (a block or a list of notes
+    and chords) as a block, looked up in (and kept in) the cache by
+    the voice's content (and extra, if what compile makes depends on
+    more than the voice)."""
+    blk = _voice_to_block(vc)
+    key = block_key(blk) if extra is None else (block_key(blk), extra)
+    val = cache.get(key)
+    if val is None:
+        val = compile(blk)
+        cache.put(key, val)
+    return val
@@ -1,4 +1,7 @@
+import os
 
+# output backend (rtmidi or capture) and the rtmidi api
+backend = "rtmidi"
 api = "alsa"
 bend_range = 2 # semitones
 # Midi input Port Identifier
@@ -6,3 +9,18 @@ synths = ["fluid"]
 # number of channels (max 16 client ports X 16 chnls = 256 for fluidsynth?)
 # max ports for fluid synth is 8
 port_count = 1
+# how many seconds ahead of the playhead notes are pulled from
+# generator/async iterator scores
+lookahead = 1
+# send messages from a dedicated (higher priority) thread per synth,
+# bursts of messages are handed to them sender_lead seconds ahead of
+# their time (with several synths the threads are always used)
+sender_thread = False
+sender_lead = 0.05
+# number of messages the playback telemetry keeps
+telemetry_size = 2 ** 16
+# where reader.parse_many caches parsed files and how big the cache may get
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "milton")
+cache_max_bytes = 2 ** 30
+# how many compiled voices the realtime and the writer caches keep
+compile_cache_size = 256
@@ -1,3 +1,6 @@
 class CUZeroHzErr(Exception):
     pass
     
+
+class NoFreeChnlErr(Exception):
+    pass
@@ -0,0 +1,70 @@
+"""
+An interval tree over the notes of a voice or score, for asking
+which notes sound at a time
+"""
+import numpy as np
+
+# nodes with fewer intervals are leaves, scanned as a whole
+_LEAF_SIZE = 32
+
+
+class IntervalTree:
+    """A centered interval tree over the intervals [starts[i], ends[i]).
+    Every node keeps the intervals containing it's center (sorted by
+    start and by end) and leaves those ending before it to the left
+    child and those starting after it to the right one. Finding the k
+    intervals containing a time walks one path of about log n nodes,
+    with a binary search at each, so it costs O(log^2 n + k) however
+    long the intervals are. Intervals of no length contain nothing and
+    are left out. The nodes are built on the first query."""
+
+    def __init__(self, starts, ends):
+        self.starts = np.asarray(starts, dtype=float)
+        self.ends = np.asarray(ends, dtype=float)
+        self._nodes = None
+
+    def _build(self):
+        s, e = self.starts, self.ends
+        # (center, left, right, rows by start, sorted starts, rows by end, sorted ends),
+        # leaves are (None, rows, starts, ends)
+        self._nodes = []
+        todo = [(np.flatnonzero(e > s), None, None)]
+        while todo:
+            rows, parent, side = todo.pop()
+            i = len(self._nodes)
+            if parent is not None:
+                self._nodes[parent][side] = i
+            if len(rows) <= _LEAF_SIZE:
+                self._nodes.append([None, rows, s[rows], e[rows]])
+                continue
+            # the median start is inside at least one interval (it's own)
+            center = np.partition(s[rows], len(rows) // 2)[len(rows) // 2]
+            left = e[rows] <= center
+            right = s[rows] > center
+            mid = rows[~left & ~right]
+            by_start = mid[np.argsort(s[mid], kind="stable")]
+            by_end = mid[np.argsort(e[mid], kind="stable")]
+            self._nodes.append([center, -1, -1, by_start, s[by_start], by_end, e[by_end]])
+            todo.append((rows[left], i, 1))
+            todo.append((rows[right], i, 2))
+
+    def at(self, t):
+        """Returns the (sorted) indices of the intervals containing t."""
+        if self._nodes is None:
+            self._build()
+        found = []
+        i = 0
+        while i >= 0:
+            node = self._nodes[i]
+            if node[0] is None:
+                _, rows, starts, ends = node
+                found.append(rows[(starts <= t) & (ends > t)])
+                break
+            center, left, right, by_start, starts, by_end, ends = node
+            if t < center: # all of them end after t
+                found.append(by_start[:np.searchsorted(starts, t, side="right")])
+                i = left
+            else: # all of them start before t
+                found.append(by_end[np.searchsorted(ends, t, side="right"):])
+                i = right
+        return np.sort(np.concatenate(found))
@@ -1,35 +1,342 @@
 """
 Reading and parsing midi files
 """
+import os
+import re
+import mmap
+import time
+import hashlib
+from array import array
 import numpy as np
-from mido import (MidiFile, bpm2tempo, tick2second)
-
-
-def _parse_track(track, tpb, tscale):
-    nons = [x for x in track if x.type == "note_on"]
-    onset = dur = 0
-    vc_data = []
-    if nons:
-        for non_msg, nof_msg in np.split(np.asarray(nons), len(nons)//2):
-            onset += tick2second(
-                    non_msg.time, tpb, bpm2tempo(60)
-                ) * tscale 
-            dur = tick2second(
-                    nof_msg.time, tpb, bpm2tempo(60)
-                ) * tscale
-            non_msg_vars = vars(non_msg)
-            data = {
-                "pch": non_msg_vars["note"],
-                "onset": onset,
-                "dur": dur,
-                "chnl": non_msg_vars["channel"] + 1,
-                "vel": non_msg_vars["velocity"]
-            } 
-            vc_data.append(data)
-            onset += dur
-    return vc_data
+import milton.cfg
+from milton.tempo import TempoMap
+
+
+def _read_vlq(data, pos):
+    """Returns the variable-length quantity at pos and the position after it."""
+    val = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        val = (val << 7) | (b & 0x7f)
+        if b < 0x80:
+            return val, pos
+
+def _pair_fifo(ticks, chnl_key, is_on):
+    """Returns the indices of the note ons and of their note offs,
+    pairing them per channel and key first in first out. Ons without
+    an off are paired with -1, offs without an on are dropped."""
+    n = len(ticks)
+    order = np.lexsort((np.arange(n), chnl_key)) # by key, then in time
+    key, on = chnl_key[order], is_on[order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = key[1:] != key[:-1]
+    grp_start = np.flatnonzero(first)
+    grp = np.cumsum(first) - 1
+    ons, offs = np.cumsum(on), np.cumsum(~on)
+    # counts before each key group
+    ons0 = (ons - on)[grp_start][grp]
+    offs0 = (offs - ~on)[grp_start][grp]
+    if np.any((ons - ons0) < (offs - offs0)):
+        # an off comes before it's on, pair one by one
+        return _pair_fifo_seq(chnl_key, is_on)
+    # the k-th on of a key pairs with the k-th off of the key
+    on_rank = (key * n + ons - ons0 - 1)[on]
+    off_rank = (key * n + offs - offs0 - 1)[~on]
+    i = np.searchsorted(off_rank, on_rank)
+    matched = i < len(off_rank)
+    matched[matched] = off_rank[i[matched]] == on_rank[matched]
+    off_idx = np.full(len(on_rank), -1)
+    off_idx[matched] = order[~on][i[matched]]
+    return order[on], off_idx
+
+def _pair_fifo_seq(chnl_key, is_on):
+    on_idx, off_idx = [], []
+    pending = dict()
+    for i, (key, on) in enumerate(zip(chnl_key.tolist(), is_on.tolist())):
+        if on:
+            pending.setdefault(key, []).append(len(on_idx))
+            on_idx.append(i)
+            off_idx.append(-1)
+        elif pending.get(key):
+            off_idx[pending[key].pop(0)] = i
+    return np.array(on_idx, dtype=np.int64), np.array(off_idx, dtype=np.int64)
+
+# a run of channel events with two data bytes (note off/on, poly pressure,
+# control change, pitch bend): delta, optional status, two data bytes
+_RUN = re.compile(rb"(?:[\x80-\xff]{0,3}[\x00-\x7f][\x80-\xbf\xe0-\xef]?[\x00-\x7f]{2})+")
+
+def _decode_run(run, tick, status):
+    """Decodes a run of channel events with two data bytes at once.
+    Every event of the run has exactly three bytes below 0x80 (the last
+    byte of the delta and the two data bytes), so the events can be
+    found without walking them. Returns the ticks, statuses, first and
+    second data bytes of the events."""
+    seg = np.frombuffer(run, dtype=np.uint8).astype(np.int64)
+    low = np.flatnonzero(seg < 0x80)
+    l0, l1, l2 = low[0::3], low[1::3], low[2::3]
+    starts = np.concatenate(([0], l2[:-1] + 1))
+    # deltas: the last byte plus up to three leading ones
+    deltas = seg[l0].copy()
+    for j in (1, 2, 3):
+        has = l0 - starts >= j
+        deltas[has] += (seg[l0[has] - j] & 0x7f) << (7 * j)
+    # running status is carried forward from the last explicit status
+    explicit = l1 - l0 == 2
+    statuses = np.where(explicit, seg[np.minimum(l0 + 1, len(seg) - 1)], status)
+    last = np.maximum.accumulate(np.where(explicit, np.arange(len(l0)), -1))
+    statuses = np.where(last >= 0, statuses[np.maximum(last, 0)], status)
+    return tick + np.cumsum(deltas), statuses, seg[l1], seg[l2]
+
+def _parse_track(data, pos, end, tempos):
+    """Returns a block of the notes in the track chunk data[pos:end],
+    with onsets and durations in ticks, and adds the (tick, tempo) of
+    every set tempo event to tempos.
+    Note ons are paired with the next note off (or note on with velocity 0)
+    of the same channel and key, overlapping notes of a key are paired
+    first in first out. Notes still sounding at the end of the track
+    end there. Runs of two-data-byte channel events (i.e. nearly all of
+    a notes track) are decoded vectorized, only the rest is walked."""
+    # parts of (ticks, channel << 7 | key, velocity (0 for offs)) in file order
+    parts = []
+    ticks, chnl_keys, vels = array("q"), array("q"), array("q")
+    tick = status = 0
+    data = bytes(data[pos:end]) # one track at a time, indexing bytes is fast
+    pos, end = 0, len(data)
+    while pos < end:
+        if status == 0 or status & 0xf0 not in (0xc0, 0xd0):
+            m = _RUN.match(data, pos)
+            if m:
+                run_ticks, sts, data1, data2 = _decode_run(m.group(), tick, status)
+                notes = (sts & 0xe0) == 0x80 # note on/off
+                parts.append((np.frombuffer(ticks, dtype=np.int64),
+                              np.frombuffer(chnl_keys, dtype=np.int64),
+                              np.frombuffer(vels, dtype=np.int64)))
+                parts.append((run_ticks[notes],
+                              (sts[notes] & 0x0f) << 7 | data1[notes],
+                              np.where(sts[notes] & 0xf0 == 0x90, data2[notes], 0)))
+                ticks, chnl_keys, vels = array("q"), array("q"), array("q")
+                tick, status = int(run_ticks[-1]), int(sts[-1])
+                pos = m.end()
+                continue
+        b = data[pos]
+        if b < 0x80: # most deltas fit in one byte
+            tick += b
+            pos += 1
+        else:
+            delta, pos = _read_vlq(data, pos)
+            tick += delta
+        b = data[pos]
+        if b >= 0x80: # otherwise running status
+            pos += 1
+            if b == 0xff: # meta event
+                kind = data[pos]
+                size, pos = _read_vlq(data, pos + 1)
+                if kind == 0x51 and size == 3: # set tempo
+                    tempos.append((tick, int.from_bytes(data[pos:pos + 3], "big")))
+                pos += size
+                continue
+            if b == 0xf0 or b == 0xf7: # sysex
+                size, pos = _read_vlq(data, pos)
+                pos += size
+                continue
+            status = b
+        kind = status & 0xf0
+        if kind == 0x90 or kind == 0x80:
+            ticks.append(tick)
+            chnl_keys.append((status & 0x0f) << 7 | data[pos])
+            # note offs get velocity 0
+            vels.append(data[pos + 1] if kind == 0x90 else 0)
+            pos += 2
+        elif kind == 0xc0 or kind == 0xd0: # one data byte
+            pos += 1
+        else:
+            pos += 2
+    parts.append((np.frombuffer(ticks, dtype=np.int64),
+                  np.frombuffer(chnl_keys, dtype=np.int64),
+                  np.frombuffer(vels, dtype=np.int64)))
+    ticks, chnl_keys, vels = (np.concatenate(col) for col in zip(*parts))
+    on_idx, off_idx = _pair_fifo(ticks, chnl_keys, vels > 0)
+    on = ticks[on_idx]
+    off = np.where(off_idx >= 0, ticks[off_idx], tick)
+    order = np.argsort(on, kind="stable")
+    return {
+        "type": "block",
+        "onset": on[order],
+        "dur": (off - on)[order],
+        "knum": (chnl_keys[on_idx] & 0x7f)[order].astype(float),
+        "vel": vels[on_idx][order].astype(int),
+        "chnl": (chnl_keys[on_idx] >> 7)[order] + 1,
+    }
+
+def _parse(data, tscale):
+    if data[:4] != b"MThd":
+        raise ValueError("not a midi file")
+    hdr_size = int.from_bytes(data[4:8], "big")
+    tpb = int.from_bytes(data[12:14], "big")
+    if tpb & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    pos = 8 + hdr_size
+    tracks = []
+    tempos = []
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos + 4:pos + 8], "big")
+        if data[pos:pos + 4] == b"MTrk":
+            tracks.append(_parse_track(data, pos + 8, pos + 8 + size, tempos))
+        pos += 8 + size
+    # the tempo changes (of any track) apply to all tracks
+    tmap = TempoMap(*zip(*tempos), tpb) if tempos else TempoMap([], [], tpb)
+    for blk in tracks:
+        on = tmap.to_secs(blk["onset"])
+        blk["dur"] = (tmap.to_secs(blk["onset"] + blk["dur"]) - on) * tscale
+        blk["onset"] = on * tscale
+    return tracks
 
 def parse(path, tscale=1):
-    fl = MidiFile(path)
-    return [_parse_track(t, fl.ticks_per_beat, tscale) for t in fl.tracks]
+    """Returns a block (see utils.make_notes) of the notes of each
+    track of the midi file, timed by the file's tempo changes (and
+    scaled by tscale)."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _parse(data, tscale)
+
+
+# the parsed-file cache: per file the rows of all tracks (<key>.npy)
+# and the offsets of the tracks in the rows (<key>.idx.npy)
+_CACHE_VERSION = 2
+# leftovers of writers older than this (seconds) are removed
+_CACHE_STALE_SECS = 3600
+_CACHE_DTYPE = np.dtype([("onset", "<f8"), ("dur", "<f8"), ("knum", "<f8"),
+                         ("vel", "<i8"), ("chnl", "<i8")])
+
+def _cache_key(data):
+    return hashlib.blake2b(data, digest_size=20, person=b"milton%d" % _CACHE_VERSION).hexdigest()
+
+def _cache_paths(cache_dir, key):
+    return os.path.join(cache_dir, key + ".npy"), os.path.join(cache_dir, key + ".idx.npy")
+
+def _save_atomic(path, arr):
+    # write next to the target and rename, so that concurrent
+    # readers see either nothing or the whole file
+    tmp = f"{path}.{os.getpid()}.{os.urandom(4).hex()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+def _cache_store(cache_dir, key, tracks):
+    rows = np.empty(sum(len(t["onset"]) for t in tracks), dtype=_CACHE_DTYPE)
+    offsets = np.zeros(len(tracks) + 1, dtype=np.int64)
+    for i, t in enumerate(tracks):
+        offsets[i + 1] = offsets[i] + len(t["onset"])
+        for name in _CACHE_DTYPE.names:
+            rows[name][offsets[i]:offsets[i + 1]] = t[name]
+    rows_path, idx_path = _cache_paths(cache_dir, key)
+    _save_atomic(rows_path, rows)
+    _save_atomic(idx_path, offsets) # last, marks the entry complete
+
+def _cache_load(cache_dir, key, tscale):
+    """Returns the tracks of the cached entry (memory-mapped), or None."""
+    rows_path, idx_path = _cache_paths(cache_dir, key)
+    try:
+        offsets = np.load(idx_path)
+        rows = np.load(rows_path, mmap_mode="r")
+        os.utime(idx_path) # recently used
+    except (FileNotFoundError, ValueError):
+        return None
+    tracks = []
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        t = rows[a:b]
+        tracks.append({
+            "type": "block",
+            "onset": t["onset"] * tscale,
+            "dur": t["dur"] * tscale,
+            "knum": t["knum"], "vel": t["vel"], "chnl": t["chnl"],
+        })
+    return tracks
+
+def _cache_evict(cache_dir, max_bytes):
+    """Removes the least recently used entries until the cache
+    is at most max_bytes big. Temporary files of killed writers and
+    rows without an index older than _CACHE_STALE_SECS are removed
+    first, younger ones (maybe still being written) count towards
+    the size."""
+    entries = []
+    total = 0
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            size = os.path.getsize(path)
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError: # evicted by another process
+            continue
+        if name.endswith(".idx.npy"):
+            key = name[:-len(".idx.npy")]
+            try:
+                size += os.path.getsize(_cache_paths(cache_dir, key)[0])
+            except FileNotFoundError:
+                pass
+            entries.append((mtime, size, key))
+        elif name.endswith(".tmp") or (
+                name.endswith(".npy") and not os.path.exists(path[:-len(".npy")] + ".idx.npy")):
+            if now - mtime > _CACHE_STALE_SECS:
+                _remove(path)
+                continue
+        else: # rows of an entry, counted with it's index
+            continue
+        total += size
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        for p in reversed(_cache_paths(cache_dir, key)):
+            _remove(p)
+        total -= size
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _parse_to_cache(path, cache_dir):
+    """Makes sure the file is in the cache and returns it's key."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            key = _cache_key(data)
+            if not os.path.exists(_cache_paths(cache_dir, key)[1]):
+                _cache_store(cache_dir, key, _parse(data, 1))
+    return key
 
+def parse_many(paths, tscale=1, processes=None, cache=True):
+    """Returns the parsed tracks (see parse) of every file, parsing them
+    in a pool of processes (processes=None uses all cores). With cache on
+    every file is parsed only once, keyed by it's content, and later
+    loaded memory-mapped from cfg.cache_dir, which is kept below
+    cfg.cache_max_bytes by dropping the least recently used files."""
+    paths = list(paths)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(paths)))
+    if cache:
+        cache_dir = milton.cfg.cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        fn, args = _parse_to_cache, [cache_dir] * len(paths)
+    else:
+        fn, args = parse, [tscale] * len(paths)
+    if processes == 1:
+        results = list(map(fn, paths, args))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes) as pool:
+            chunk = max(1, len(paths) // (processes * 4))
+            results = list(pool.map(fn, paths, args, chunksize=chunk))
+    if not cache:
+        return results
+    parsed = []
+    for path, key in zip(paths, results):
+        tracks = _cache_load(cache_dir, key, tscale)
+        if tracks is None: # evicted meanwhile
+            tracks = parse(path, tscale)
+        parsed.append(tracks)
+    _cache_evict(cache_dir, milton.cfg.cache_max_bytes)
+    return parsed
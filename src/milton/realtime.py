@@ -1,42 +1,43 @@
 import time
+import heapq
 import asyncio
-import rtmidi
-import rtmidi.midiutil
+import threading
+import numpy as np
 import milton.cfg
 import milton.err
-from math import (modf, log2)
-from datetime import datetime, timedelta
-from contextlib import ExitStack
-from rtmidi.midiconstants import (
-    NOTE_OFF, NOTE_ON, PITCH_BEND,
-    ALL_SOUND_OFF, CONTROL_CHANGE,
-    RESET_ALL_CONTROLLERS
-)
-
-def _get_api(api):
-    return {
-        "unspec": rtmidi.API_UNSPECIFIED,
-        "core": rtmidi.API_MACOSX_CORE,
-        "alsa": rtmidi.API_LINUX_ALSA,
-        "jack": rtmidi.API_UNIX_JACK,
-        "win": rtmidi.API_WINDOWS_MM,
-        "dummy": rtmidi.API_RTMIDI_DUMMY
-    }[api]
-
-_client_registry = dict()
-_chnls_usage = {
-    # channel: [reference/usage, status]
-    # status = is in use by a microtone (if usage > 0)
-    # status False and reference>0 means in-use by equal tempered notes
-    chnl: [0, None] for chnl in range(milton.cfg.port_count * 16)
-}
-# This is the client used on each processing, and
-# is set one per each proc call.
-_CLIENT = None
+import milton.alloc
+import milton.sender
+import milton.cache
+import milton.timeline
+from milton.itree import IntervalTree
+from milton.utils import _split_knums
+from math import modf
+from functools import lru_cache
+from itertools import count
+import milton.backend
+
+# status bytes and controllers (as in rtmidi.midiconstants)
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+PITCH_BEND = 0xE0
+ALL_SOUND_OFF = 0x78
+RESET_ALL_CONTROLLERS = 0x79
+
+# the session of init (used when play is given none)
+_session = None
 _NO_BEND_VAL = 2 ** 13
 _NO_BEND_RESET_LSB = _NO_BEND_VAL & 0x7f # isthis msb or lsb for send_message?!??
 _NO_BEND_RESET_MSB = (_NO_BEND_VAL >> 7) & 0x7f
 _SEMITONE_BEND_RANGE = 4096
+# timeline event kinds, offs sort before ons of the same time
+_NOF, _NON = 0, 1
+# the next note of a prefetched stream isn't there yet (see _Prefetch)
+_NOT_YET = object()
+# notes a _Prefetch pulls ahead at most
+_PREFETCH_SIZE = 64
+# compiled (sorted _get_ons tuples) voices and blocks, by content
+_compiled = milton.cache.LRU()
 
 
 def _get_clientid_and_chnl(chnl):
@@ -46,11 +47,27 @@ def _get_clientid_and_chnl(chnl):
     return client_id, client_chnl
 
 
-def _get_bend_msgs(knum, knum_ipart, ch):
-    bend_val = _NO_BEND_VAL + _NO_BEND_VAL * (12 / milton.cfg.bend_range) * log2(knum_to_hz(knum) / knum_to_hz(knum_ipart))
-    # note that crazy fractional parts could result in loss of information(because of rounding)
-    bend_val = round(bend_val)
-    bend_msg = (PITCH_BEND + ch, bend_val & 0x7f, (bend_val >> 7) & 0x7f)
+@lru_cache
+def _bend_table(bend_range):
+    """Returns the 14-bit (lsb, msb) pitch bend pairs for every cent
+    offset 0-100 above a key number, for the bend range in semitones."""
+    cents = np.arange(101)
+    vals = np.rint(_NO_BEND_VAL + _NO_BEND_VAL * cents / (100 * bend_range))
+    vals = np.clip(vals, 0, 2 ** 14 - 1).astype(int)
+    return tuple(zip((vals & 0x7f).tolist(), ((vals >> 7) & 0x7f).tolist()))
+
+def _split_knum(knum):
+    fpart, ipart = modf(knum)
+    cent = round(fpart * 100)
+    if cent == 100:
+        return int(ipart) + 1, 0
+    return int(ipart), cent
+
+def _get_bend_msgs(cent, ch):
+    # bend values depend only on the cent offset and the bend range,
+    # so they are looked up rather than computed
+    lsb, msb = _bend_table(milton.cfg.bend_range)[cent]
+    bend_msg = (PITCH_BEND + ch, lsb, msb)
     bend_reset_msg = (PITCH_BEND + ch, _NO_BEND_RESET_LSB, _NO_BEND_RESET_MSB)
     return bend_msg, bend_reset_msg
 
@@ -72,189 +89,659 @@ def _get_non_nof_msgs(knum_ipart, ch, vel):
 
 
 
-def _is_chnl_free_for_micton(chnl):
-    """Returns true if chnl is accessible for a microtone, ie
-    no other references to this channel exist."""
-    return _chnls_usage[chnl][0] == 0 
-
-def _is_chnl_free_for_eqtemp(chnl):
-    """Returns true if channel is accessible for an equal-tempered note,
-    ie either no references to the channel exist, or those references
-    are all to eqaul-tempered notes too."""
-    return _chnls_usage[chnl][0] == 0 or\
-           _chnls_usage[chnl][1] is False
-
-def _get_next_free_chnl_for_micton():
-    """Returns the next for microtones accessible channel, ie
-    a channel with 0 references."""
-    for chnl, stat in _chnls_usage.items():
-        if stat[0] == 0: # 0 references
-            return chnl
-
-def _get_next_free_chnl_for_eqtemp():
-    """Returns the next for equal-tempered notes free channel, ie
-    a channel with zero references or with references to other
-    equal-tempered notes."""
-    for chnl, stat in _chnls_usage.items():
-        if stat[0] == 0 or stat[1] is False:
-            return chnl
-
-def _verify_setup_chnl_for_micton_ip(midi_chnl):
-    global _chnls_usage
-    if not _is_chnl_free_for_micton(midi_chnl):
-        midi_chnl = _get_next_free_chnl_for_micton()
-    # increment channel's usage
-    _chnls_usage[midi_chnl][0] = 1
-    # set status to in-use by a microtone
-    _chnls_usage[midi_chnl][1] = True
-    return midi_chnl
-
-def _verify_setup_chnl_for_eqtemp_ip(midi_chnl):
-    global _chnls_usage
-    if not _is_chnl_free_for_eqtemp(midi_chnl):
-        midi_chnl = _get_next_free_chnl_for_eqtemp()
-    # increment channel's references
-    _chnls_usage[midi_chnl][0] += 1
-    # set status to in-use by non-microtones if not happened yet
-    if _chnls_usage[midi_chnl][1] is not False:
-        _chnls_usage[midi_chnl][1] = False
-    return midi_chnl
-
-def _get_msgs(knum, midi_chnl, vel) -> tuple:
-    non_msg = nof_msg = bend_msg = bend_reset_msg = None
-    fpart, ipart = modf(knum)
-    ipart = int(ipart)
-    if fpart: # is microtonal
-        midi_chnl = _verify_setup_chnl_for_micton_ip(midi_chnl)
-        bend_msg, bend_reset_msg = _get_bend_msgs(knum, ipart, midi_chnl)
+def _send_non_bend(chnls, t, ipart, cent, chnl, vel, dur, timeline, seq, burst):
+    """Adds the note on (and the pitch bend of a microtone) to the burst
+    and schedules the note off. The note gets it's channel (from the
+    allocator chnls) only now that it starts sounding, and gives it
+    back with the note off."""
+    chnl -= 1
+    if cent: # is microtonal
+        chnl = chnls.acquire_micton(chnl)
     else:
-        midi_chnl = _verify_setup_chnl_for_eqtemp_ip(midi_chnl)
-    non_msg, nof_msg = _get_non_nof_msgs(ipart, midi_chnl, vel)
-    return non_msg, nof_msg, bend_msg, bend_reset_msg, midi_chnl
-
-
-
-async def _send_non_bend(t, non, bend, clients):
-    await asyncio.sleep(t)
-    for client in clients:
-        if bend:
-            client.send_message(bend)
-        client.send_message(non)
-
-async def _send_nof_bend_reset(t,dur,nof, bend_reset, chnl_, clients):
-    global _chnls_usage
-    await asyncio.sleep(t+dur)
-    for client in clients:
-        client.send_message(nof)
-        if bend_reset:
-            _chnls_usage[chnl_][0] -= 1
-            assert _chnls_usage[chnl_][0] == 0
-            _chnls_usage[chnl_][1] = None
-            client.send_message(bend_reset)
-        else:
-            _chnls_usage[chnl_][0] -= 1
-            if _chnls_usage[chnl_][0] == 0:
-                _chnls_usage[chnl_][1] = None
-
-
-def _get_note_data(knum, chnl, vel):
-    # get clients
-    client_id, chnl = _get_clientid_and_chnl(chnl)
-    # client = _client_registry[client_id]
-    clients = []
-    for synth in milton.cfg.synths:
-        clients.append(_client_registry[synth][client_id])
-    non, nof, bend, bend_reset, chnl_ = _get_msgs(knum, chnl, vel)
-    # return non, nof, bend, bend_reset, chnl_, client
-    return {
-        "non": non, "nof": nof, "bend": bend, "bend_reset": bend_reset,
-        "chnl": chnl_, "clients": clients
-    }
-
-
-def init(): 
+        chnl = chnls.acquire_eqtemp(chnl)
+    client_id, client_chnl = _get_clientid_and_chnl(chnl + 1)
+    non, nof = _get_non_nof_msgs(ipart, client_chnl, vel)
+    bend_reset = None
+    # messages go to the port, the senders send them to every synth
+    if cent:
+        bend, bend_reset = _get_bend_msgs(cent, client_chnl)
+        burst.append((client_id, bend))
+    burst.append((client_id, non))
+    heapq.heappush(
+        timeline, (t + dur, _NOF, next(seq), (nof, bend_reset, chnl, client_id))
+    )
+
+def _send_nof_bend_reset(chnls, nof, bend_reset, chnl, client_id, burst):
+    burst.append((client_id, nof))
+    if bend_reset:
+        burst.append((client_id, bend_reset))
+    chnls.release(chnl)
+
+
+class Session:
+    """Owns the output clients of a group of ports (the ports-th ports
+    of every synth in cfg.synths, default all cfg.port_count), the
+    allocator of their channels and the clock playback is timed by.
+    Notes refer to channels only by index (channel 1 is the first one
+    of the session's first port), so several sessions can play
+    different port groups at once, each in it's own process if need
+    be (see play_parallel). The clock must tick like time.monotonic,
+    which the sender threads time the bursts by."""
+
+    def __init__(self, backend=None, ports=None, clock=time.monotonic):
+        self.ports = list(range(milton.cfg.port_count) if ports is None else ports)
+        self.backend = milton.backend.get_backend(milton.cfg.backend if backend is None else backend)
+        self.clock = clock
+        self.chnls = milton.alloc.ChnlAllocator(len(self.ports) * 16)
+        # {synth: {port index in the session: client}}
+        self.registry = {
+            synth: {i: self.backend.open(synth, port) for i, port in enumerate(self.ports)}
+            for synth in milton.cfg.synths
+        }
+
+    def client_ports(self):
+        """Returns {client: port} of all clients."""
+        return {client: self.ports[i] for clients in self.registry.values()
+                for i, client in clients.items()}
+
+    def client_synths(self):
+        """Returns {client: synth name} of all clients."""
+        return {client: synth for synth, clients in self.registry.items()
+                for client in clients.values()}
+
+    def occupancy(self):
+        """Returns {channel: (references, status)} of the channels
+        which are currently in-use by sounding notes (status is True
+        for a microtone and False for equal-tempered notes)."""
+        return self.chnls.occupancy()
+
+    def close(self):
+        self.backend.close()
+
+    def panic(self, pause=0.05):
+        """Turns all sound off on every channel, pausing pause seconds
+        between the channels (0 never blocks, e.g. an event loop)."""
+        print("\nPanic...")
+        for synthXXX in self.registry.values():
+            for client in synthXXX.values():
+                print(f"Turning off client {client}")
+                for chnl in range(16):
+                    client.send_message([CONTROL_CHANGE | chnl, ALL_SOUND_OFF, 0])
+                    client.send_message([CONTROL_CHANGE | chnl, RESET_ALL_CONTROLLERS, 0])
+                    if pause:
+                        time.sleep(pause)
+                if pause:
+                    time.sleep(pause)
+
+
+def _get_session():
+    if _session is None:
+        init()
+    return _session
+
+def client_ports():
+    """Returns {client: port index} of all clients of init's session."""
+    return _session.client_ports() if _session else dict()
+
+
+def client_synths():
+    """Returns {client: synth name} of all clients of init's session."""
+    return _session.client_synths() if _session else dict()
+
+
+def occupancy():
+    """Returns the occupancy (see Session.occupancy) of init's session."""
+    return _session.occupancy() if _session else dict()
+
+
+def init(backend=None):
     """Opens output ports on each client. This should happen
-    before sending anything to the processor."""
-    api = _get_api(milton.cfg.api)
-    # save a list of available ports
-    tmp_client = rtmidi.MidiOut(rtapi=api)
-    available_ports = [p.lower() for p in tmp_client.get_ports()]
-    tmp_client.delete()
-    for synth in milton.cfg.synths:
-        _client_registry[synth] = dict()
-        # hopefuly ports are listed in right order by get_ports!!!
-        _SYNTH_PORT_IDXS = [i for i, p in enumerate(available_ports) if synth.lower() in p]
-        for i in range(milton.cfg.port_count):
-            # create a new output client and register it
-            client = rtmidi.MidiOut(name=f"Milton Client {synth}", rtapi=api)
-            client.open_port(_SYNTH_PORT_IDXS[i], f"Output Port")
-            _client_registry[synth][i] = client
+    before sending anything to the processor.
+    backend is a backend.Backend or the name of one (rtmidi, capture),
+    the default is cfg.backend. The ports and their channels make up
+    the session play uses by default."""
+    global _session
+    _session = Session(backend)
+    return _session.backend
 
 def close_ports():
-    for synthXXX in _client_registry.values():
-        for client in synthXXX.values():
-            client.close_port()
-            client.delete()
-
-
-def _panic():
-    print("\nPanic...")
-    for synthXXX in _client_registry.values():
-        for client in synthXXX.values():
-            print(f"Turning off client {client}")
-            for chnl in range(16):
-                client.send_message([CONTROL_CHANGE | chnl, ALL_SOUND_OFF, 0])
-                client.send_message([CONTROL_CHANGE | chnl, RESET_ALL_CONTROLLERS, 0])
-                time.sleep(0.05)
-            time.sleep(0.05)
-
-def _add_note_task(nt: dict) -> list:
-    return [
-        # note on
-        asyncio.create_task(
-        _send_non_bend(
-            nt["onset"], nt["non"], nt["bend"], nt["clients"])
-        ),
-        # note off
-        asyncio.create_task(
-        _send_nof_bend_reset(
-            nt["onset"], nt["dur"], nt["nof"],
-            nt["bend_reset"], nt["chnl"], nt["clients"])
-        )
-    ]
-
-
-
-async def play(events, script):
+    if _session:
+        _session.close()
+
+
+def _get_ons(nt):
+    """Returns what is needed to start the note:
+    (onset, key number, cent offset, channel, velocity, duration)"""
+    return (nt["onset"], *_split_knum(nt["knum"]), nt["chnl"], nt["vel"], nt["dur"])
+
+def _is_block(ev):
+    return isinstance(ev, dict) and ev["type"] == "block"
+
+def _iter_block_ons(blk):
+    """Yields the rows of a block (see utils.make_notes) in onset order."""
+    order = np.argsort(blk["onset"], kind="stable")
+    ipart, cent = _split_knums(blk["knum"][order])
+    yield from zip(
+        blk["onset"][order].tolist(), ipart.tolist(), cent.tolist(),
+        *(blk[k][order].tolist() for k in ("chnl", "vel", "dur"))
+    )
+
+def _iter_ons(ev):
+    """Yields the notes of a note, chord, block or voice."""
+    try:
+        if ev["type"] == "note":
+            yield _get_ons(ev)
+        elif ev["type"] == "chord":
+            for nt in ev["notes"]:
+                yield _get_ons(nt)
+        elif ev["type"] == "block":
+            yield from _iter_block_ons(ev)
+    except TypeError: # ev must be a list/tuple
+        for x in ev:
+            if x["type"] == "note":
+                yield _get_ons(x)
+            elif x["type"] == "chord":
+                for nt in x["notes"]:
+                    yield _get_ons(nt)
+            else:
+                raise ValueError(f"can't proc {x}")
+
+def _is_stream(events):
+    """Returns true if events is a generator/iterator or an async iterator,
+    i.e. something which should be pulled lazily rather than walked."""
+    return hasattr(events, "__aiter__") or \
+        (hasattr(events, "__next__") and iter(events) is events)
+
+def _is_async(events):
+    """Returns true if events is (or is a list holding) an async
+    iterator, which can be played but not compiled."""
+    if hasattr(events, "__aiter__"):
+        return True
+    return isinstance(events, (list, tuple)) and any(hasattr(ev, "__aiter__") for ev in events)
+
+async def _aiter_ons(stream):
+    """Yields the notes of a stream of notes, chords and voices."""
+    if hasattr(stream, "__aiter__"):
+        async for ev in stream:
+            for ons in _iter_ons(ev):
+                yield ons
+    else:
+        for ev in stream:
+            for ons in _iter_ons(ev):
+                yield ons
+            # let the dispatcher run between slow generator steps
+            await asyncio.sleep(0)
+
+def _compile_ons(blk):
+    """Returns the notes of the block sorted by onset, their onsets and
+    an itree.IntervalTree of them (the index for seeking)."""
+    ons = list(_iter_block_ons(blk))
+    onsets = np.array([o[0] for o in ons], dtype=float)
+    ends = onsets + np.array([o[5] for o in ons], dtype=float)
+    return ons, onsets, IntervalTree(onsets, ends)
+
+def _region(compiled, start=0, end=None):
+    """Returns the notes of a compiled voice which sound in [start, end),
+    with the onsets relative to start. Notes already sounding at start
+    are retriggered at 0 (for the rest of their dur), notes are cut at
+    end. Only the notes inside the region (and those sounding at start,
+    found with the interval tree) are looked at."""
+    ons, onsets, tree = compiled
+    if not start and end is None:
+        return ons
+    a = np.searchsorted(onsets, start, side="left")
+    b = len(ons) if end is None else np.searchsorted(onsets, end, side="left")
+    sounding = tree.at(start)
+    region = [(0, *ons[i][1:5], ons[i][0] + ons[i][5] - start) for i in sounding[sounding < a].tolist()]
+    region += [(o[0] - start, *o[1:]) for o in ons[a:b]]
+    if end is not None:
+        region = [(*o[:5], min(o[5], end - start - o[0])) for o in region]
+    return region
+
+async def _aiter_region(region, length=0, passes=1):
+    """Yields the notes of the region, passes times one after
+    another (forever if passes is None)."""
+    if not region: # nothing to repeat, don't spin
+        return
+    for p in (count() if passes is None else range(passes)):
+        off = p * length
+        for o in region:
+            yield (o[0] + off, *o[1:]) if off else o
+
+async def _aiter_stream_region(ons, start=0, end=None):
+    """Like _region for the notes of a stream."""
+    async for o in ons:
+        if end is not None and o[0] >= end:
+            break
+        if o[0] < start:
+            if o[0] + o[5] > start: # still sounding
+                o = (start, *o[1:5], o[0] + o[5] - start)
+            else:
+                continue
+        o = (o[0] - start, *o[1:])
+        if end is not None:
+            o = (*o[:5], min(o[5], end - start - o[0]))
+        yield o
+
+
+class _Live:
+    """What a PlaybackHandle tells it's dispatcher: new streams, no
+    more streams (closed) or stop now (stopped)."""
+
+    def __init__(self):
+        self.new = []
+        self.wake = asyncio.Event()
+        self.closed = False
+        self.stopped = False
+
+
+def _send_burst(session, burst, due, sender, telemetry):
+    if sender:
+        sender.submit(due, burst)
+    else:
+        for clients in session.registry.values():
+            milton.sender.send_burst(burst, clients, due, telemetry)
+
+
+def _pop_burst(chnls, timeline, seq):
+    """Pops the events of the timeline (a heap) due at it's first time,
+    allocating their channels, returns the time and the burst of their
+    messages. The note offs of the note ons are pushed to the timeline.
+    Shared by the dispatcher and the timeline compiler, so a compiled
+    timeline sends what playing would."""
+    t = timeline[0][0]
+    burst = []
+    while timeline and timeline[0][0] == t:
+        _, kind, _, args = heapq.heappop(timeline)
+        if kind == _NON:
+            _send_non_bend(chnls, t, *args, timeline, seq, burst)
+        else:
+            _send_nof_bend_reset(chnls, *args, burst)
+    return t, burst
+
+class _Prefetch:
+    """An async stream (of a user's async iterator) pulled by a task of
+    it's own into a bounded queue, so a stream awaiting between it's
+    notes never holds up the dispatcher and the other streams. The
+    dispatcher polls it and is woken when a note arrives."""
+
+    def __init__(self, ons):
+        self.ons = ons
+        self.error = None
+        self.task = None
+
+    def start(self, wake):
+        self.wake = wake
+        self.queue = asyncio.Queue(_PREFETCH_SIZE)
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            async for o in self.ons:
+                await self.queue.put(o)
+                self.wake.set()
+        except Exception as e: # raised by poll, in the dispatcher
+            self.error = e
+        await self.queue.put(None)
+        self.wake.set()
+
+    def poll(self):
+        """Returns the next note, None at the end or _NOT_YET."""
+        try:
+            o = self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return _NOT_YET
+        if o is None and self.error:
+            raise self.error
+        return o
+
+    def cancel(self):
+        if self.task:
+            self.task.cancel()
+
+
+async def _pull(p):
+    """Sets p[0] to the next note of the pending stream p[1], None at
+    it's end (or _NOT_YET if a _Prefetch has none ready)."""
+    if isinstance(p[1], _Prefetch):
+        p[0] = p[1].poll()
+    else: # never waits (compiled voices, generators)
+        p[0] = await anext(p[1], None)
+
+async def _dispatch(session, timeline, seq, streams=(), lookahead=None, sender=None, telemetry=None, at=None,
+                    live=None):
+    """Sends every event of the timeline (a heap) at its time. All times
+    are measured against one monotonic start time, so onsets don't drift
+    however many events the score has.
+    Notes of the streams (async iterators of _get_ons tuples in onset
+    order) are pulled only up to lookahead seconds ahead of the playhead,
+    a stream is not advanced further until the playhead catches up.
+    Streams of async iterators (see _Prefetch) are pulled in tasks of
+    their own, the dispatcher only takes what they have ready.
+    Messages due at the same time are sent as one burst (of (port,
+    message) pairs), if a sender (see sender.FanOut) is given the bursts
+    are handed to it cfg.sender_lead seconds ahead of their time.
+    Time 0 is at the session's clock time at, by default now.
+    With a live (see PlaybackHandle) streams can be added while
+    playing, the dispatcher waits for them until live is closed,
+    if it is stopped all sounding notes are turned off at once."""
+    if lookahead is None:
+        lookahead = milton.cfg.lookahead
+    lead = milton.cfg.sender_lead if sender else 0
+    # set by live submissions and by notes arriving from prefetches
+    wake = live.wake if live else asyncio.Event()
+    # pending: [next note (None at the end, or _NOT_YET), async notes iterator]
+    pending = []
+    prefetches = []
+    async def add(ons):
+        if isinstance(ons, _Prefetch):
+            ons.start(wake)
+            prefetches.append(ons)
+        p = [_NOT_YET, ons]
+        await _pull(p)
+        pending.append(p)
+    try:
+        for ons in streams:
+            await add(ons)
+        clock = session.clock
+        start = clock() if at is None else at
+        while True:
+            if live:
+                if live.stopped:
+                    burst = []
+                    for _, kind, _, args in sorted(timeline):
+                        if kind == _NOF:
+                            _send_nof_bend_reset(session.chnls, *args, burst)
+                    timeline.clear()
+                    _send_burst(session, burst, clock(), sender, telemetry)
+                    break
+                while live.new:
+                    await add(live.new.pop(0))
+            for p in pending:
+                if p[0] is _NOT_YET:
+                    await _pull(p)
+                playhead = clock() - start
+                while p[0] is not None and p[0] is not _NOT_YET and p[0][0] <= playhead + lookahead:
+                    heapq.heappush(timeline, (p[0][0], _NON, next(seq), p[0][1:]))
+                    await _pull(p)
+            pending = [p for p in pending if p[0] is not None]
+            # send everything due, back-to-back
+            playhead = clock() - start
+            while timeline and timeline[0][0] <= playhead + lead:
+                t, burst = _pop_burst(session.chnls, timeline, seq)
+                _send_burst(session, burst, start + t, sender, telemetry)
+            if not timeline and not pending and not (live and not live.closed):
+                break
+            due = min(
+                ([timeline[0][0] - lead] if timeline else []) +
+                [p[0][0] - lookahead for p in pending if p[0] is not _NOT_YET],
+                default=None
+            )
+            delay = None if due is None else due - (clock() - start)
+            if live or prefetches:
+                # sleep, unless something is submitted or arrives meanwhile
+                try:
+                    await asyncio.wait_for(wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+            elif delay > 0:
+                await asyncio.sleep(delay)
+    finally:
+        for ons in prefetches:
+            ons.cancel()
+
+
+def _split_events(events):
+    """Returns the streams of the events and their other voices
+    compiled (see _compile_ons), the free notes/chords compiled as
+    one more voice. Voices are compiled once (as long as they don't
+    change), the compiled ones are pulled like streams."""
+    if _is_stream(events) or isinstance(events, dict): # a single one
+        events = [events]
+    streams = []
+    frei = []
+    compiled = []
+    for ev in events:
+        if _is_stream(ev):
+            streams.append(ev)
+        elif isinstance(ev, dict) and ev["type"] in ("note", "chord"):
+            frei.append(ev)
+        else:
+            compiled.append(milton.cache.compiled(_compiled, ev, _compile_ons))
+    if frei:
+        compiled.append(milton.cache.compiled(_compiled, frei, _compile_ons))
+    return streams, compiled
+
+def _get_streams(events, start=0, end=None, loop=False):
+    """Returns the streams of the notes of the events (see play)."""
+    if end is not None and end <= start:
+        raise ValueError(f"can't play the empty region {start}-{end}")
+    raw, compiled = _split_events(events)
+    if raw and loop:
+        raise ValueError("can't loop a stream")
+    streams = [_aiter_stream_region(_aiter_ons(ev), start, end) for ev in raw]
+    # async iterators may wait between notes, they are pulled aside
+    streams = [_Prefetch(st) if _is_async(ev) else st for ev, st in zip(raw, streams)]
+    length, passes = 0, 1
+    if loop:
+        if end is None:
+            end = max((c[2].ends.max() for c in compiled if c[0]), default=start)
+        length = end - start
+        if length <= 0:
+            raise ValueError(f"can't loop the empty region {start}-{end}")
+        passes = None if loop is True else loop
+    for c in compiled:
+        # the region is cut out once, every pass reuses it
+        streams.append(_aiter_region(_region(c, start, end), length, passes))
+    return streams
+
+def _get_sender(session, telemetry):
+    # several synths get a sender thread each, so they don't wait for each other
+    if milton.cfg.sender_thread or len(session.registry) > 1:
+        return milton.sender.FanOut(session.registry, telemetry)
+    return None
+
+async def _aiter_shifted(ons, offset):
+    async for o in ons:
+        yield (o[0] + offset, *o[1:])
+
+
+def _compile_timeline(events, port_count):
+    """Runs the dispatcher's scheduling and channel allocation offline,
+    returns the Timeline of the sent bursts."""
+    streams, compiled = _split_events(events)
+    chnls = milton.alloc.ChnlAllocator(port_count * 16)
+    seq = count()
+    timeline = []
+    # in the order the dispatcher pulls them: streams, then the compiled voices
+    for ev in streams:
+        if _is_async(ev):
+            raise ValueError("can't compile an async iterator")
+        # walked up front
+        timeline.extend((o[0], _NON, next(seq), o[1:]) for x in ev for o in _iter_ons(x))
+    for c in compiled:
+        timeline.extend((o[0], _NON, next(seq), o[1:]) for o in c[0])
+    heapq.heapify(timeline)
+    bursts = []
+    while timeline:
+        bursts.append(_pop_burst(chnls, timeline, seq))
+    return milton.timeline.Timeline(bursts, port_count)
+
+async def _dispatch_bursts(session, tl, sender=None, telemetry=None, at=None):
+    """Sends the bursts of the compiled timeline at their times."""
+    if tl.port_count > len(session.ports):
+        raise ValueError(f"the timeline needs {tl.port_count} ports, the session has {len(session.ports)}")
+    lead = milton.cfg.sender_lead if sender else 0
+    clock = session.clock
+    start = clock() if at is None else at
+    for t, burst in tl.bursts:
+        delay = start + t - lead - clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        _send_burst(session, burst, start + t, sender, telemetry)
+
+
+async def play(events, script, lookahead=None, telemetry=None, start=0, end=None, loop=False,
+               session=None, at=None):
     """Run the fun, processing the rtmidi calls and cleanup if called from within a script.
     If running from inside a script also dealloc the MIDI_OUT_CLIENT object.
     proc should be given one single
     fun which is your whole composition, don't call it multiple times
-    via iteration etc."""
-    tasks = []
+    via iteration etc.
+    events (or any of its voices) can also be a generator or an async
+    iterator of notes, chords and voices arriving in onset order, these
+    are streamed with a bounded lookahead (default cfg.lookahead) instead
+    of being walked up front. Blocks of notes (see utils.make_notes)
+    are streamed the same way. The compiled notes of every voice and
+    block are cached (see cache.py), playing a score again only
+    compiles the voices which have changed.
+    Only the region from start to end (seconds of the score, end None
+    is the end of the score) is played, notes sounding at start are
+    retriggered. With loop True the region is repeated until
+    interrupted, with loop a number that many times (streams can't
+    be looped).
+    If a telemetry.Telemetry is given the timing of every sent message
+    is recorded into it.
+    The notes are played by the session (default the one of init, made
+    if there is none yet), starting at it's clock time at (default now).
+    events can also be a compiled timeline.Timeline, which is sent as it
+    is (no compiling or channel allocation while playing)."""
+    if session is None:
+        session = _get_session()
+    timeline = []
+    seq = count()
+    # bad regions fail before any sender thread is started
+    if isinstance(events, milton.timeline.Timeline):
+        if start or end is not None or loop:
+            raise ValueError("can't play a region of a compiled timeline")
+        streams = None
+    else:
+        streams = _get_streams(events, start, end, loop)
+    sender = _get_sender(session, telemetry)
+    done = False
     try:
-        for ev in events:
-            try:
-                if ev["type"] == "note":
-                    tasks.extend(_add_note_task(ev))
-                elif ev["type"] == "chord":
-                    for nt in ev["notes"]:
-                        tasks.extend(_add_note_task(nt))
-            except TypeError: # ev must be a list/tuple
-                for x in ev: 
-                    if x["type"] == "note":
-                        tasks.extend(_add_note_task(x))
-                    elif x["type"] == "chord":
-                        for nt in x["notes"]:
-                            tasks.extend(_add_note_task(nt))
-                    else:
-                        raise ValueError(f"can't proc {x}")
-        await asyncio.gather(*tasks)
-    except (EOFError, KeyboardInterrupt, asyncio.CancelledError):
-        _panic()
+        try:
+            if streams is None:
+                await _dispatch_bursts(session, events, sender, telemetry, at)
+            else:
+                await _dispatch(session, timeline, seq, streams, lookahead, sender, telemetry, at)
+            done = True
+        finally:
+            # on any error the bursts not sent yet are dropped
+            if sender:
+                sender.close(cancel=not done)
+    except (EOFError, KeyboardInterrupt):
+        session.panic()
+    except asyncio.CancelledError:
+        # the caller's event loop goes on, don't sleep on it
+        session.panic(pause=0)
+        raise
     except (milton.err.CUZeroHzErr):
         print("can't convert 0 hz to midi knum")
+    except (milton.err.NoFreeChnlErr):
+        session.panic()
+        print("no free channel left for a microtone, try a higher cfg.port_count")
     finally:
         if script: # done running python script.py, close and cleanup
-            close_ports()
+            session.close()
+
 
+def _play_part(ports, events, backend, at, lookahead, telemetry):
+    import milton.telemetry
+    session = Session(backend, ports)
+    tele = milton.telemetry.Telemetry(session.client_ports(), synths=session.client_synths()) if telemetry else None
+    try:
+        asyncio.run(play(events, False, lookahead, tele, session=session, at=at))
+    finally:
+        session.close()
+    return tele.report() if tele else None
+
+def play_parallel(parts, backend=None, delay=0.5, lookahead=None, telemetry=False):
+    """Plays every part, a (ports, events) pair, in a process of it's
+    own with a Session of the ports, all starting together delay
+    seconds from now (time.monotonic is the same clock in every
+    process). events must be picklable (notes, chords, blocks,
+    voices of them), backend the name of a backend.
+    Returns the telemetry reports of the parts if telemetry is true."""
+    from concurrent.futures import ProcessPoolExecutor
+    at = time.monotonic() + delay
+    with ProcessPoolExecutor(len(parts)) as pool:
+        futs = [pool.submit(_play_part, ports, events, backend, at, lookahead, telemetry)
+                for ports, events in parts]
+        return [f.result() for f in futs]
+
+
+class PlaybackHandle:
+    """A performance running in the background (in a thread with an
+    event loop of it's own) until stopped: events can be submitted
+    to it any time while it plays, without restarting anything.
+    The session's clients and the dispatcher stay warm in between."""
+
+    def __init__(self, session=None, lookahead=None, telemetry=None):
+        self.session = session or _get_session()
+        self.telemetry = telemetry
+        self.lookahead = lookahead
+        self.start = None
+        self._live = _Live()
+        self._ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),),
+                                        name="milton playback", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    async def _run(self):
+        sender = _get_sender(self.session, self.telemetry)
+        self.start = self.session.clock()
+        self._ready.set()
+        try:
+            await _dispatch(self.session, [], count(), (), self.lookahead, sender,
+                            self.telemetry, self.start, self._live)
+        finally:
+            if sender:
+                sender.close()
+
+    @property
+    def playhead(self):
+        """Seconds since the performance started."""
+        return self.session.clock() - self.start
+
+    @property
+    def playing(self):
+        return self._thread.is_alive()
+
+    def _wake(self):
+        self._live.wake.set()
+
+    def submit(self, events, offset=None):
+        """Adds the events (as given to play) to the performance, their
+        onsets offset seconds after it's start (default the playhead,
+        i.e. onset 0 is now)."""
+        if self._live.closed or self._live.stopped:
+            raise RuntimeError("can't submit to a finished performance")
+        offset = self.playhead if offset is None else offset
+        streams = [_aiter_shifted(ons, offset) for ons in _get_streams(events)]
+        def add():
+            self._live.new.extend(streams)
+            self._wake()
+        self._loop.call_soon_threadsafe(add)
+
+    def wait(self, timeout=None):
+        """Takes no more events and waits until everything submitted
+        has been played."""
+        def close():
+            self._live.closed = True
+            self._wake()
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(close)
+        self._thread.join(timeout)
+
+    def stop(self):
+        """Stops the performance now, turning off all sounding notes."""
+        def stop():
+            self._live.stopped = True
+            self._wake()
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(stop)
+        self._thread.join()
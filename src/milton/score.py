@@ -0,0 +1,99 @@
+"""
+A score of voices, indexed by time
+"""
+import numpy as np
+from milton.utils import _voice_to_block, is_block
+from milton.itree import IntervalTree
+
+_COLS = ("onset", "dur", "knum", "vel", "chnl")
+
+
+class Score:
+    """Voices kept as blocks, with an index over all their notes for
+    the questions: what sounds at t, what starts in [a, b) and when
+    is the next onset. The index is a sorted array of the onsets, for
+    binary searching what starts when, and an itree.IntervalTree of
+    the notes, for what is sounding at a time (O(log^2 n + k) for the
+    k notes found, however long the notes are). It is (re)built on the
+    first query after adding.
+    A score iterates over it's voices as blocks, so it can be given
+    to proc and writer.save as it is."""
+
+    def __init__(self, events=()):
+        self.voices = []
+        self._index = None
+        self.add(events)
+
+    def add(self, events):
+        """Adds every voice, block, note and chord of the events (as
+        given to proc). The free notes/chords of one call go into a
+        voice of their own."""
+        frei = []
+        for e in events:
+            if is_block(e):
+                self.voices.append(e)
+            elif isinstance(e, dict) and e["type"] in ("note", "chord"):
+                frei.append(e)
+            else:
+                self.voices.append(_voice_to_block(e))
+        if frei:
+            self.voices.append(_voice_to_block(frei))
+        self._index = None
+
+    def __iter__(self):
+        return iter(self.voices)
+
+    def __len__(self):
+        return sum(len(vc["onset"]) for vc in self.voices)
+
+    def _get_index(self):
+        if self._index is None:
+            cols = {k: np.concatenate([vc[k] for vc in self.voices] or [np.zeros(0)])
+                    for k in _COLS}
+            cols["voice"] = np.repeat(np.arange(len(self.voices)),
+                                      [len(vc["onset"]) for vc in self.voices])
+            order = np.argsort(cols["onset"], kind="stable")
+            idx = {k: col[order] for k, col in cols.items()}
+            idx["end"] = idx["onset"] + idx["dur"]
+            self._tree = IntervalTree(idx["onset"], idx["end"])
+            self._end = float(idx["end"].max()) if len(order) else 0.0
+            self._index = idx
+        return self._index
+
+    def _take(self, rows):
+        idx = self._get_index()
+        blk = {"type": "block", **{k: idx[k][rows] for k in _COLS}}
+        blk["voice"] = idx["voice"][rows] # where each note comes from
+        return blk
+
+    def block(self):
+        """Returns all notes as one block in onset order."""
+        return self._take(slice(None))
+
+    def at(self, t):
+        """Returns the block of the notes sounding at t."""
+        self._get_index()
+        return self._take(self._tree.at(t))
+
+    def window(self, a, b, overlap=False):
+        """Returns the block of the notes starting in [a, b), with overlap
+        also of those started earlier and still sounding at a."""
+        idx = self._get_index()
+        lo = np.searchsorted(idx["onset"], a, side="left")
+        hi = np.searchsorted(idx["onset"], b, side="left")
+        if not overlap:
+            return self._take(slice(lo, hi))
+        # the notes sounding at a which started before it come first
+        before = self._tree.at(a)
+        return self._take(np.concatenate((before[before < lo], np.arange(lo, max(lo, hi)))))
+
+    def next_onset(self, t):
+        """Returns the first onset after t, or None."""
+        onset = self._get_index()["onset"]
+        i = np.searchsorted(onset, t, side="right")
+        return float(onset[i]) if i < len(onset) else None
+
+    def end(self):
+        """Returns the time the last note ends."""
+        self._get_index()
+        return self._end
@@ -0,0 +1,126 @@
+"""
+Sending midi messages from a dedicated thread
+"""
+import os
+import time
+import threading
+from collections import deque
+
+
+def _raise_priority():
+    """Asks the OS to run the calling thread with real-time (or at
+    least higher) priority, quietly giving up if it isn't allowed."""
+    try:
+        # on linux pid 0 is the calling thread
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, -10)
+    except (AttributeError, OSError):
+        pass
+
+
+def send_burst(burst, clients, due=None, telemetry=None):
+    """Sends the list of (port, message) pairs to the clients
+    ({port: client}) back-to-back, port after port (keeping the
+    order of each port's messages).
+    If a telemetry is given the due time and the actual time of each
+    message is recorded."""
+    by_port = dict()
+    for port, msg in burst:
+        by_port.setdefault(port, []).append(msg)
+    for port, msgs in by_port.items():
+        client = clients[port]
+        for msg in msgs:
+            client.send_message(msg)
+            if telemetry:
+                telemetry.record(due, time.monotonic(), client, msg)
+
+
+class Sender:
+    """A thread which sends bursts of already encoded messages to the
+    clients ({port: client}) at their due (time.monotonic) time. Bursts
+    are handed over ahead of time (see cfg.sender_lead) through a deque,
+    whose append and popleft need no locks, so stalls of the event loop
+    or garbage collection in the composing code don't delay the sending.
+    max_lag is the latest a burst has started sending."""
+
+    # sleep until this close to the due time, then spin
+    SPIN = 0.001
+
+    def __init__(self, clients, telemetry=None, name="milton sender"):
+        self.clients = clients
+        self.telemetry = telemetry
+        self.max_lag = 0.0
+        self._bursts = deque()
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, due, burst):
+        self._bursts.append((due, burst))
+        self._wake.set()
+
+    def close(self, cancel=False):
+        """Waits until every submitted burst is sent (or drops the
+        pending ones if cancel is true) and ends the thread."""
+        if cancel:
+            self._bursts.clear()
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        _raise_priority()
+        while True:
+            if not self._bursts:
+                if self._closing:
+                    break
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            due, burst = self._bursts[0]
+            delay = due - time.monotonic()
+            if delay > self.SPIN:
+                self._wake.wait(delay - self.SPIN)
+                self._wake.clear()
+                continue
+            while time.monotonic() < due:
+                pass
+            try:
+                self._bursts.popleft()
+            except IndexError: # cancelled meanwhile
+                continue
+            self.max_lag = max(self.max_lag, time.monotonic() - due)
+            send_burst(burst, self.clients, due, self.telemetry)
+
+
+class FanOut:
+    """One Sender per synth of the registry ({synth: {port: client}}),
+    every burst is handed to all of them, so a slow or blocked synth
+    only delays itself. On closing the lag of every synth's thread
+    (see lags) goes into the telemetry's report."""
+
+    def __init__(self, registry, telemetry=None):
+        self.telemetry = telemetry
+        self.senders = {
+            synth: Sender(clients, telemetry, f"milton sender {synth}")
+            for synth, clients in registry.items()
+        }
+
+    def submit(self, due, burst):
+        for sender in self.senders.values():
+            sender.submit(due, burst)
+
+    def close(self, cancel=False):
+        for sender in self.senders.values():
+            sender.close(cancel)
+        if self.telemetry:
+            self.telemetry.sender_lags.update(self.lags())
+
+    def lags(self):
+        """Returns {synth: the latest a burst has started sending}."""
+        return {synth: sender.max_lag for synth, sender in self.senders.items()}
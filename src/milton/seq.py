@@ -0,0 +1,56 @@
+"""
+Sequences of numbers (onsets, durations, intervals, ...) as numpy
+arrays, in and out. The list versions in utils wrap these.
+"""
+import numpy as np
+
+
+def dur_to_onset(durs, init=0):
+    """Returns the onsets of the durations played one after another
+    starting at init."""
+    durs = np.asarray(durs)
+    onsets = np.empty(len(durs), dtype=np.result_type(durs, init))
+    if len(durs):
+        onsets[0] = init
+        np.cumsum(durs[:-1], out=onsets[1:])
+        onsets[1:] += init
+    return onsets
+
+def onset_to_dur(onsets):
+    """Returns the durations between the onsets."""
+    return np.diff(np.asarray(onsets))
+
+def intervals(ns):
+    """Returns the differences of the neighbouring numbers."""
+    return np.diff(np.asarray(ns))
+
+def normsum(ns, total=1):
+    """Returns the numbers scaled to sum up to total."""
+    ns = np.asarray(ns, dtype=float)
+    return ns * (total / ns.sum())
+
+def minmax_norm(x, minx, maxx, low_bound=0, up_bound=1):
+    """Returns x (a number or an array) linearly rescaled from
+    minx-maxx to low_bound-up_bound."""
+    if not np.isscalar(x):
+        x = np.asarray(x, dtype=float)
+    return low_bound + (x - minx) * (up_bound - low_bound) / (maxx - minx)
+
+def geom_seq(init, rate, count):
+    """Returns the first count terms of the geometric sequence."""
+    return init * np.power(float(rate), np.arange(count))
+
+def rotation(a, n):
+    """Returns the nth rotation of a, e.g. rotation([1,2,3,4], 2)
+    => [3,4,1,2]."""
+    return np.roll(np.asarray(a), -n, axis=0)
+
+def rotation_idxs(size, count):
+    """Returns the indices of the first count rotations of a sequence
+    of size items, one rotation per row."""
+    return (np.arange(count)[:, None] + np.arange(size)) % max(size, 1)
+
+def rotations(a, count):
+    """Returns the first count rotations of a, one per row."""
+    a = np.asarray(a)
+    return a[rotation_idxs(len(a), count)]
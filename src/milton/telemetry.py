@@ -0,0 +1,86 @@
+"""
+Measuring the timing accuracy of realtime playback
+"""
+import json
+import threading
+import numpy as np
+import milton.cfg
+
+# upper bounds (in seconds) of the lateness histogram's bins
+_HIST_EDGES = (0, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+
+class Telemetry:
+    """Records the scheduled and the actual send time of every message,
+    with it's port, synth and channel, in preallocated ring buffers (of
+    size cfg.telemetry_size). Once full the oldest records are
+    overwritten. Records can come from several sender threads."""
+
+    def __init__(self, ports=None, size=None, synths=None):
+        # ports: {client: port index}, synths: {client: synth name}
+        self.ports = ports or dict()
+        synths = synths or dict()
+        self.synth_names = sorted(set(synths.values()))
+        self.synths = {client: self.synth_names.index(synth) for client, synth in synths.items()}
+        self.size = size or milton.cfg.telemetry_size
+        self.sched = np.zeros(self.size)
+        self.actual = np.zeros(self.size)
+        self.port = np.zeros(self.size, dtype=np.int16)
+        self.synth = np.zeros(self.size, dtype=np.int16)
+        self.chnl = np.zeros(self.size, dtype=np.int8)
+        self.count = 0
+        # {synth: the latest a burst has started sending}, of the
+        # sender threads (see sender.FanOut)
+        self.sender_lags = dict()
+        self._lock = threading.Lock()
+
+    def record(self, sched, actual, client, msg):
+        with self._lock:
+            i = self.count % self.size
+            self.count += 1
+        self.sched[i] = sched
+        self.actual[i] = actual
+        self.port[i] = self.ports.get(client, -1)
+        self.synth[i] = self.synths.get(client, -1)
+        self.chnl[i] = msg[0] & 0x0f
+
+    def report(self):
+        """Returns the latency percentiles, the maximum lateness,
+        histograms of the lateness by port and by channel, the
+        lateness of every synth and the lag of every synth's sender
+        thread, if there were some (in seconds)."""
+        n = min(self.count, self.size)
+        late = self.actual[:n] - self.sched[:n]
+        labels = ["<0"] + [f"<{e}" for e in _HIST_EDGES[1:]] + [f">={_HIST_EDGES[-1]}"]
+        bins = np.searchsorted(_HIST_EDGES, late, side="right")
+        def hist(keys):
+            return {
+                int(k): dict(zip(labels, np.bincount(bins[keys == k], minlength=len(labels)).tolist()))
+                for k in np.unique(keys)
+            }
+        rep = {"count": self.count, "recorded": n}
+        if n:
+            rep.update({
+                "latency": dict(zip(
+                    ("p50", "p90", "p99", "p99.9"),
+                    np.percentile(late, (50, 90, 99, 99.9)).tolist()
+                )),
+                "mean": float(late.mean()),
+                "max_lateness": float(late.max()),
+                "by_port": hist(self.port[:n]),
+                "by_chnl": hist(self.chnl[:n]),
+                "by_synth": {
+                    self.synth_names[k]: dict(zip(
+                        ("p50", "p99", "max_lateness"),
+                        np.percentile(late[self.synth[:n] == k], (50, 99, 100)).tolist()
+                    ))
+                    for k in np.unique(self.synth[:n]) if k >= 0
+                },
+            })
+        if self.sender_lags:
+            rep["sender_lag"] = dict(self.sender_lags)
+        return rep
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,65 @@
+"""
+Tempo maps: converting between midi ticks and seconds
+"""
+import hashlib
+import numpy as np
+
+# the tempo of a midi file without tempo events (120 bpm)
+DEFAULT_TEMPO = 500_000
+
+
+class TempoMap:
+    """The tempo changes of a midi file: from ticks[i] on a beat lasts
+    tempos[i] microseconds, a beat has tpb ticks. secs[i] is the time
+    (in seconds) of ticks[i], so converting is a binary search for the
+    last change before a time and a linear step from there, done for
+    whole arrays at once."""
+
+    def __init__(self, ticks, tempos, tpb):
+        ticks = np.asarray(ticks, dtype=np.int64)
+        tempos = np.asarray(tempos, dtype=np.int64)
+        order = np.argsort(ticks, kind="stable")
+        ticks, tempos = ticks[order], tempos[order]
+        if not len(ticks) or ticks[0] > 0:
+            ticks = np.concatenate(([0], ticks))
+            tempos = np.concatenate(([DEFAULT_TEMPO], tempos))
+        # of several changes at the same tick the last one counts
+        last = np.append(ticks[1:] != ticks[:-1], True)
+        self.ticks, self.tempos = ticks[last], tempos[last]
+        self.tpb = tpb
+        # seconds per tick from each change on
+        self._spt = self.tempos / (1e6 * tpb)
+        self.secs = np.concatenate(([0.0], np.cumsum(np.diff(self.ticks) * self._spt[:-1])))
+
+    @classmethod
+    def from_bpms(cls, times, bpms, tpb):
+        """Returns the map of the tempos bpms[i] (beats per minute)
+        starting at times[i] (seconds). Tempos change on whole ticks."""
+        times = np.asarray(times, dtype=float)
+        tempos = np.rint(6e7 / np.asarray(bpms, dtype=float)).astype(np.int64)
+        if len(times) and times[0] > 0: # the default tempo until the first change
+            times = np.concatenate(([0.0], times))
+            tempos = np.concatenate(([DEFAULT_TEMPO], tempos))
+        ticks = np.zeros(len(times))
+        ticks[1:] = np.cumsum(np.diff(times) * 1e6 * tpb / tempos[:-1])
+        return cls(np.rint(ticks), tempos, tpb)
+
+    def to_secs(self, ticks):
+        """Converts ticks (a number or an array) to seconds."""
+        ticks = np.asarray(ticks)
+        i = np.searchsorted(self.ticks, ticks, side="right") - 1
+        return self.secs[i] + (ticks - self.ticks[i]) * self._spt[i]
+
+    def to_ticks(self, secs):
+        """Converts seconds (a number or an array) to (whole) ticks."""
+        secs = np.asarray(secs, dtype=float)
+        i = np.maximum(np.searchsorted(self.secs, secs, side="right") - 1, 0)
+        return np.rint(self.ticks[i] + (secs - self.secs[i]) / self._spt[i]).astype(np.int64)
+
+    @property
+    def key(self):
+        """A hash of the map (for caching what is encoded with it)."""
+        h = hashlib.blake2b(digest_size=16)
+        for arr in (self.ticks, self.tempos, np.array([self.tpb])):
+            h.update(arr.tobytes())
+        return h.hexdigest()
@@ -0,0 +1,41 @@
+"""
+Compiling events into a flat timeline of midi messages, which both
+realtime playback and the writer can consume
+"""
+import numpy as np
+from milton import cfg
+
+
+class Timeline:
+    """The messages of compiled events (see compile) in the order they
+    are sent, as bursts of messages due at the same time and as the
+    structured array msgs of (time, port, chnl, status, data1, data2)
+    rows. Channels are allocated once at compile time, the same way
+    playback allocates them, so a timeline can be played and saved
+    any number of times without compiling again."""
+
+    DTYPE = np.dtype([("time", "<f8"), ("port", "<i2"), ("chnl", "u1"),
+                      ("status", "u1"), ("data1", "u1"), ("data2", "u1")])
+
+    def __init__(self, bursts, port_count):
+        # [(time, [(port, (status byte, data1, data2)), ...]), ...]
+        self.bursts = bursts
+        self.port_count = port_count
+        rows = [(t, port, msg[0] & 0x0f, msg[0] & 0xf0, msg[1], msg[2])
+                for t, burst in bursts for port, msg in burst]
+        self.msgs = np.array(rows, dtype=self.DTYPE)
+
+    def __len__(self):
+        return len(self.msgs)
+
+    @property
+    def end(self):
+        """The time of the last message."""
+        return float(self.msgs["time"][-1]) if len(self.msgs) else 0.0
+
+
+def compile(events, port_count=None):
+    """Returns the Timeline of the events (anything proc takes; finite
+    streams are consumed) for port_count ports (default cfg.port_count)."""
+    from milton import realtime
+    return realtime._compile_timeline(events, port_count or cfg.port_count)
@@ -0,0 +1,113 @@
+"""
+Lazy transformations of voices
+"""
+import numpy as np
+from milton.utils import _voice_to_block, make_note
+
+
+class Pipe:
+    """A voice (a block or a list of notes/chords) and a chain of
+    transformations, nothing is computed before the notes are needed
+    (by proc, writer.save or block). Every method returns a new pipe
+    sharing the voice, the voice itself is never changed.
+    On evaluation the transpositions, time scalings/shifts and
+    velocity maps are folded into one linear map per column, applied
+    once at the end. Retrograde, rotate and filter only rearrange
+    row indices (filter and retrograde look at the notes as they are
+    at that step)."""
+
+    def __init__(self, vc, steps=()):
+        self.vc = vc
+        self.steps = tuple(steps)
+
+    def _then(self, *step):
+        return Pipe(self.vc, self.steps + (step,))
+
+    def transpose(self, n):
+        return self._then("transpose", n)
+
+    def scale(self, factor, origin=0):
+        """Stretches onsets (around origin) and durations by factor."""
+        return self._then("scale", factor, origin)
+
+    def shift(self, dt):
+        return self._then("shift", dt)
+
+    def retrograde(self):
+        """Reverses the voice in time, the last note ending first."""
+        return self._then("retrograde")
+
+    def rotate(self, n):
+        """Rotates the key numbers n notes backwards (in the voice's
+        order of notes), the rhythm stays."""
+        return self._then("rotate", n)
+
+    def filter(self, pred):
+        """Keeps the notes for which pred (given the notes as a block)
+        is true, pred returns a boolean array."""
+        return self._then("filter", pred)
+
+    def vel(self, f):
+        """Maps the velocities with f (given an array), or sets them
+        all to f if it is a number."""
+        return self._then("vel", f)
+
+    def block(self):
+        """Evaluates the chain, returns the notes as a block."""
+        src = _voice_to_block(self.vc)
+        # rows of the notes (idx) and of their key numbers (kidx)
+        idx = kidx = np.arange(len(src["onset"]))
+        # onset = p * onset + q * dur + r, dur = s * dur
+        lin = [1, 0, 0, 1]
+        trans = 0
+        vels = []
+        for step, *args in self.steps:
+            if step == "transpose":
+                trans += args[0]
+            elif step == "scale":
+                k, o = args
+                lin = [k * lin[0], k * lin[1], o + k * (lin[2] - o), k * lin[3]]
+            elif step == "shift":
+                lin[2] += args[0]
+            elif step == "retrograde":
+                if len(idx):
+                    end = _view(src, idx, kidx, lin, trans, vels)
+                    end = (end["onset"] + end["dur"]).max()
+                    lin = [-lin[0], -lin[1] - lin[3], end - lin[2], lin[3]]
+                idx, kidx = idx[::-1], kidx[::-1]
+            elif step == "rotate":
+                kidx = np.roll(kidx, -args[0])
+            elif step == "filter":
+                keep = np.asarray(args[0](_view(src, idx, kidx, lin, trans, vels)), dtype=bool)
+                idx, kidx = idx[keep], kidx[keep]
+            elif step == "vel":
+                vels.append(args[0])
+        return _view(src, idx, kidx, lin, trans, vels)
+
+    def notes(self):
+        """Evaluates the chain, returns the notes as a list of notes."""
+        blk = self.block()
+        return [make_note(*row) for row in zip(
+            blk["knum"].tolist(), blk["onset"].tolist(), blk["dur"].tolist(),
+            blk["chnl"].tolist(), blk["vel"].tolist()
+        )]
+
+    def __iter__(self):
+        """Iterates over the notes (see notes), so a pipe can be used
+        like a list of notes, e.g. in utils.mix."""
+        return iter(self.notes())
+
+
+def _view(src, idx, kidx, lin, trans, vels):
+    onset, dur = src["onset"][idx], src["dur"][idx]
+    vel = src["vel"][idx]
+    for f in vels:
+        vel = f(vel) if callable(f) else np.full(len(vel), f)
+    return {
+        "type": "block",
+        "onset": lin[0] * onset + lin[1] * dur + lin[2],
+        "dur": lin[3] * dur,
+        "knum": src["knum"][kidx] + trans,
+        "vel": np.clip(np.rint(vel), 0, 127).astype(int),
+        "chnl": src["chnl"][idx],
+    }
@@ -3,10 +3,15 @@ This module comprises the public interface of milton.
 """
 
 # from random.random import (random.random.choice, random, random.uniform, random.randint, random.randrange)
+import heapq
 import random
-from math import (modf, log)
-from itertools import (groupby, chain, islice)
-from milton.realtime import _get_note_data
+import numpy as np
+from math import (modf, log, log2)
+from itertools import (groupby, chain, islice, count)
+from operator import itemgetter
+from functools import lru_cache
+import milton.err
+import milton.seq
 
 INSTRUMENTS = [
     'Acoustic Grand Piano',
@@ -177,53 +182,62 @@ def note_to_number(note: str, octave: int) -> int:
     return note
 ################### https://gist.github.com/devxpy/063968e0a2ef9b6db0bd6af8079dad2a
 
-_NAMES_KNUMS = dict()
-
-for knum in range(128):
-    pset = knum % 12
-    okt = knum // 12 - 1
-    match pset:
-        case 0:
-            _NAMES_KNUMS[f"c{okt}"] = knum
-        case 1:
-            _NAMES_KNUMS[f"c#{okt}"] = knum
-            _NAMES_KNUMS[f"db{okt}"] = knum
-        case 2:
-            _NAMES_KNUMS[f"d{okt}"] = knum
-        case 3:
-            _NAMES_KNUMS[f"d#{okt}"] = knum
-            _NAMES_KNUMS[f"eb{okt}"] = knum
-        case 4:
-            _NAMES_KNUMS[f"e{okt}"] = knum
-        case 5:
-            _NAMES_KNUMS[f"f{okt}"] = knum
-        case 6:
-            _NAMES_KNUMS[f"f#{okt}"] = knum
-            _NAMES_KNUMS[f"gb{okt}"] = knum
-        case 7:
-            _NAMES_KNUMS[f"g{okt}"] = knum
-        case 8:
-            _NAMES_KNUMS[f"g#{okt}"] = knum
-            _NAMES_KNUMS[f"ab{okt}"] = knum
-        case 9:
-            _NAMES_KNUMS[f"a{okt}"] = knum
-        case 10:
-            _NAMES_KNUMS[f"a#{okt}"] = knum
-            _NAMES_KNUMS[f"bb{okt}"] = knum
-        case 11:
-            _NAMES_KNUMS[f"b{okt}"] = knum
-
-_KNUMS_NAMES = {kn: nm for nm, kn in _NAMES_KNUMS.items()}
+@lru_cache
+def _name_tables():
+    """Returns {name: key number} and the array of the names of the
+    key numbers 0-127 (built on first use)."""
+    names_knums = dict()
+    for knum in range(128):
+        pset = knum % 12
+        okt = knum // 12 - 1
+        match pset:
+            case 0:
+                names_knums[f"c{okt}"] = knum
+            case 1:
+                names_knums[f"c#{okt}"] = knum
+                names_knums[f"db{okt}"] = knum
+            case 2:
+                names_knums[f"d{okt}"] = knum
+            case 3:
+                names_knums[f"d#{okt}"] = knum
+                names_knums[f"eb{okt}"] = knum
+            case 4:
+                names_knums[f"e{okt}"] = knum
+            case 5:
+                names_knums[f"f{okt}"] = knum
+            case 6:
+                names_knums[f"f#{okt}"] = knum
+                names_knums[f"gb{okt}"] = knum
+            case 7:
+                names_knums[f"g{okt}"] = knum
+            case 8:
+                names_knums[f"g#{okt}"] = knum
+                names_knums[f"ab{okt}"] = knum
+            case 9:
+                names_knums[f"a{okt}"] = knum
+            case 10:
+                names_knums[f"a#{okt}"] = knum
+                names_knums[f"bb{okt}"] = knum
+            case 11:
+                names_knums[f"b{okt}"] = knum
+    knums_names = {kn: nm for nm, kn in names_knums.items()}
+    return names_knums, np.array([knums_names[kn] for kn in range(128)])
 
 def name_to_knum(name):
-    return _NAMES_KNUMS[name]
+    return _name_tables()[0][name]
 
 def knum_to_name(knum):
-    return _KNUMS_NAMES[knum]
+    """Returns the name of the key number (a number or an array),
+    microtones are rounded to the nearest key number."""
+    knum = np.rint(knum).astype(int)
+    if np.any((knum < 0) | (knum > 127)):
+        raise KeyError(f"no name for key number {knum}")
+    names = _name_tables()[1]
+    return str(names[knum]) if knum.ndim == 0 else names[knum]
 
 # https://www.inspiredacoustics.com/en/MIDI_note_numbers_and_center_frequencies
 PNO_LO_KNUM, PNO_HI_KNUM = 21, 108
-PNO_LO_NAME, PNO_HI_NAME = knum_to_name(PNO_LO_KNUM), knum_to_name(PNO_HI_KNUM)
+PNO_LO_NAME, PNO_HI_NAME = "a0", "c8"
 
 def make_note(pch=60, onset=0, dur=1, chnl=1, vel=127):
     data = {"type": "note"}
@@ -236,8 +250,10 @@ def make_note(pch=60, onset=0, dur=1, chnl=1, vel=127):
                  "onset":onset,
                  "dur":dur,
                  "vel":vel,
+                 # the channel actually used is allocated only when
+                 # the note is played (see realtime._send_non_bend)
+                 "chnl":chnl,
                 })
-    data.update(_get_note_data(knum, chnl, vel))
     return data
 
 
@@ -252,6 +268,32 @@ def make_chord(pchs=(60, 64, 67), onset=0, dur=1, chnl=1, vel=127):
         })
     return data
 
+def _as_knums(pchs):
+    arr = np.asarray(pchs)
+    if arr.dtype.kind in "US": # note names (maybe mixed with numbers)
+        if not isinstance(pchs, np.ndarray):
+            arr = np.asarray(pchs, dtype=object)
+        return np.array([name_to_knum(p) if isinstance(p, str) else p for p in arr.flat],
+                        dtype=float).reshape(arr.shape)
+    return arr.astype(float)
+
+def make_notes(pchs, onsets=0, durs=1, chnls=1, vels=127):
+    """Returns a block of notes, i.e. the columns onset, dur, knum, vel
+    and chnl as arrays. Any argument can be a sequence, an array or
+    a scalar (which is broadcast). Blocks can be used wherever a voice
+    is expected."""
+    knum, onset, dur, chnl, vel = np.broadcast_arrays(
+        _as_knums(pchs), onsets, durs, chnls, vels
+    )
+    return {
+        "type": "block",
+        "onset": onset.astype(float).ravel(),
+        "dur": dur.astype(float).ravel(),
+        "knum": knum.ravel().copy(),
+        "vel": vel.astype(int).ravel(),
+        "chnl": chnl.astype(int).ravel(),
+    }
+
 def pret(*xs):
     """Prints and returns the thing, good for debuging."""
     for x in xs:
@@ -272,37 +314,38 @@ def sec_to_bpm(sec):
     return 60 / sec
 
 def knum_to_hz(knum):
-    return 440 * 2 ** ((knum - 69) / 12.)
+    """Converts key numbers (a number, a sequence or an array) to Hz."""
+    if not np.isscalar(knum):
+        knum = np.asarray(knum, dtype=float)
+    return 440 * np.exp2((knum - 69) / 12.)
 
 def hz_to_knum(hz):
-    if hz == 0:
+    """Converts frequencies (a number, a sequence or an array) to key numbers."""
+    if not np.isscalar(hz):
+        hz = np.asarray(hz, dtype=float)
+    if np.any(hz == 0):
         raise milton.err.CUZeroHzErr()
-    return 12 * (log2(hz) - log2(440)) + 69
+    return 12 * (np.log2(hz) - log2(440)) + 69
 
 def get_intervals(ns):
-    return [b - a for a, b in zip(ns[:-1], ns[1:])]
+    return milton.seq.intervals(ns).tolist()
 
 
 def dur_to_onset(durs, initos=0):
     """Returns a list of (accumulated onset, corresponding duration).
     The initial onset is the desired starting onset."""
-    durs = list(durs) # convert to pop
-    onsets = []
-    while durs:
-        d = durs.pop(0)
-        onsets.append((d, initos))
-        initos += d
-    return onsets
+    durs = list(durs)
+    return list(zip(durs, milton.seq.dur_to_onset(durs, initos).tolist()))
 
 def onset_to_dur(onsets):
-    return [b - a for b, a in zip(onsets[1:], onsets[:-1])]
+    return milton.seq.onset_to_dur(onsets).tolist()
 
 def normsum(ns, _sum=1):
     """Scales a set of numbers such that they sum up 
     to _sum after scaling
 
     https://math.stackexchange.com/questions/1009138/how-do-you-scale-a-set-of-number-such-that-they-sum-to-0-5-after-scaling"""
-    return [n * _sum / sum(ns) for n in ns]
+    return milton.seq.normsum(ns, _sum).tolist()
 
 def minmax_norm(x, minx, maxx, low_bound=0, up_bound=1):
     """Min-max normalization (usually called feature scaling) performs 
@@ -310,8 +353,8 @@ def minmax_norm(x, minx, maxx, low_bound=0, up_bound=1):
     the scaled data in the range (0, 1) and arbitrarily rescale a range 
     between an arbitrary set of values (lower and upper bounds).
     Google feature scaling."""
-    rescale_rng = up_bound - low_bound
-    return low_bound + ((x - minx) * rescale_rng) / (maxx - minx) 
+    normed = milton.seq.minmax_norm(x, minx, maxx, low_bound, up_bound)
+    return normed if np.isscalar(x) else normed.tolist()
 
 def ascprob(idx, seqlen):
     return random.random() < minmax_norm(idx, 0, seqlen-1)
@@ -329,22 +372,26 @@ def get_vel(x): return x["vel"]
 
 def get_knum(nt): return nt["knum"]
 
-def get_pitch(nt): return nt["pitch"]
-def get_pitches(chd): return chd["pitches"]
+def get_pitch(nt): return nt["pch"]
+def get_pitches(chd): return chd["pchs"]
 def get_dur(nt): return nt["dur"]
 def is_note(x): return x["type"] == "note"
 def is_chord(x): return x["type"] == "chord"
+_get_row = itemgetter("onset", "dur", "knum", "vel", "chnl")
+def is_block(x): return isinstance(x, dict) and x["type"] == "block"
 
 def nth_geom_term(n, init, rate):
     """Returns the nth term of a geometric sequence."""
     return init * pow(rate, n - 1)
 
 def geom_seq(init, rate, count):
-    return [nth_geom_term(n, init, rate) for n in range(1, count + 1)]
+    return milton.seq.geom_seq(init, rate, count).tolist()
 
 
 def aspc(knum):
-    """Returns the pitch class of the key number."""
+    """Returns the pitch class of the key number (a number or an array)."""
+    if not np.isscalar(knum):
+        knum = np.asarray(knum)
     return knum % 12
 
 def clip(this, lo=0, hi=1):
@@ -357,18 +404,49 @@ def clip(this, lo=0, hi=1):
     else: # this > hi
         return hi
 
-def fit(knum, min, max, mode=0):
-    """Returns the knum transposed to be fitted into the
-    boundary of min-max."""
-    if min <= knum <= max:
-        return knum
-    else:
-        pc = aspc(knum)
-        pcs = [(aspc(kn), kn) for kn in range(min, max+1)]
-        if mode == 0: # somewhere from middle (random.random)
-            return random.choice([pckn for pckn in pcs if pckn[0] == pc])[1]
-
-
+@lru_cache
+def _register_index(min, max):
+    """Returns the key numbers of every pitch class in min-max (one
+    row per pitch class, in ascending order, padded with the last one)
+    and how many there are of each."""
+    lowest = min + (np.arange(12) - min) % 12
+    counts = np.maximum((max - lowest) // 12 + 1, 0)
+    cands = lowest[:, None] + 12 * np.minimum(np.arange(counts.max(initial=1)), np.maximum(counts - 1, 0)[:, None])
+    return cands, counts
+
+_FIT_MODES = {0: "random", "random": "random", "nearest": "nearest", "lowest": "lowest"}
+
+def fit(knum, min, max, mode=0, seed=None):
+    """Returns the knum (a number or an array) transposed by octaves
+    to be fitted into the boundary of min-max. Key numbers already
+    inside are kept, the others go to a random octave (mode random
+    or 0, seed for the random generator, by default drawn from the
+    random module so random.seed applies), the nearest one (nearest)
+    or the lowest one (lowest) of the boundary."""
+    mode = _FIT_MODES[mode]
+    knums = np.asarray(knum)
+    cands, counts = _register_index(int(min), int(max))
+    ipart = np.floor(knums).astype(int)
+    frac = knums - ipart
+    pc = ipart % 12
+    n = counts[pc]
+    # a microtone doesn't fit in the octave of max
+    n = n - ((n > 0) & (cands[pc, np.maximum(n - 1, 0)] + frac > max))
+    inside = (min <= knums) & (knums <= max)
+    if np.any(~inside & (n == 0)):
+        raise ValueError(f"can't fit {knum} into {min}-{max}")
+    if mode == "random":
+        if seed is None: # follows random.seed, as random.choice did
+            seed = random.getrandbits(64)
+        j = np.floor(np.random.default_rng(seed).random(np.shape(knums)) * n).astype(int)
+    elif mode == "lowest":
+        j = np.zeros(np.shape(knums), dtype=int)
+    else: # nearest: the lowest one if below, the highest one if above
+        j = np.where(knums < min, 0, np.maximum(n - 1, 0))
+    fitted = np.where(inside, knums, cands[pc, j] + frac)
+    if np.ndim(knum) == 0:
+        return type(knum)(fitted) if isinstance(knum, (int, float)) else fitted[()]
+    return fitted
 
 
 def _group_by_onset(vcs):
@@ -378,54 +456,140 @@ def _pitch_mixture(items):
     ps = []
     for item in items:
         if is_note(item):
-            ps.append(get_pitch(item))
+            ps.append(get_knum(item))
         elif is_chord(item):
-            ps.extend(get_pitches(item))
+            ps.extend(get_knum(nt) for nt in item["notes"])
         else:
             raise TypeError
     # Does it make any difference in which order 
     # the notes are listed?!!
     return sorted(set(ps))
 
+def _shifted(item, onset, dur):
+    """Returns a copy of the note/chord moved to onset with the dur."""
+    item = dict(item, onset=onset, dur=dur)
+    if is_chord(item):
+        item["notes"] = [dict(nt, onset=onset, dur=dur) for nt in item["notes"]]
+    return item
+
 def _str_grp_items(grp):
     sort_grp = sorted(grp, key=get_dur)
-    dur_cps = [get_dur(x) for x in sort_grp]
-    _str = [sort_grp.pop(0)]
-    i = 1
-    while sort_grp:
-        item = sort_grp.pop(0).copy()
+    _str = [sort_grp[0]]
+    for prev, item in zip(sort_grp, sort_grp[1:]):
         last_item = _str[-1]
-        item["onset"] = get_onset(last_item) + get_dur(last_item)
-        item["dur"] = dur_cps[i] - dur_cps[i-1] # dur of item is bigger than dur of last item
+        # dur of item is not smaller than dur of last item, one as
+        # long as the one before keeps it's own dur
+        dur = get_dur(item) - get_dur(prev)
+        item = _shifted(item, get_onset(last_item) + get_dur(last_item), dur if dur > 0 else get_dur(item))
         _str.append(item)
-        i += 1
     return _str
 
 
 
+def _split_knums(knums):
+    """Splits key numbers (a number or an array) into their integral
+    key numbers and the cent offsets above them. Offsets are rounded
+    to whole cents, a value rounded up to 100 cents goes to the next key."""
+    fpart, ipart = np.modf(knums)
+    cent = np.rint(fpart * 100).astype(int)
+    up = cent == 100
+    return (ipart + up).astype(int), np.where(up, 0, cent)
+
+def _voice_to_block(vc):
+    if is_block(vc):
+        return vc
+    if hasattr(vc, "block"): # lazy voices (see transform.Pipe)
+        return vc.block()
+    nts = []
+    for x in vc:
+        if is_note(x):
+            nts.append(x)
+        elif is_chord(x):
+            nts.extend(x["notes"])
+        else:
+            raise ValueError(f"can't use {x} in a voice")
+    rows = np.fromiter(
+        chain.from_iterable(map(_get_row, nts)), dtype=float, count=5 * len(nts)
+    ).reshape(-1, 5)
+    return {
+        "type": "block",
+        "onset": rows[:, 0].copy(),
+        "dur": rows[:, 1].copy(),
+        "knum": rows[:, 2].copy(),
+        "vel": rows[:, 3].astype(int),
+        "chnl": rows[:, 4].astype(int),
+    }
+
+def _mix_blocks(vcs):
+    blks = [_voice_to_block(vc) for vc in vcs]
+    cols = {k: np.concatenate([b[k] for b in blks])
+            for k in ("onset", "dur", "knum", "vel", "chnl")}
+    order = np.argsort(cols["onset"], kind="stable")
+    return {"type": "block", **{k: col[order] for k, col in cols.items()}}
+
+def _mix_group(grp, oscoll):
+    """Returns what replaces the notes/chords starting at the same time."""
+    if oscoll == "mix":
+        longest = max(grp, key=get_dur) # group's longest event
+        return [make_chord(
+            pchs=_pitch_mixture(grp),
+            onset=get_onset(longest),
+            dur=get_dur(longest),
+            chnl=get_chnl(longest) if is_note(longest) else get_chnl(longest["notes"][0]),
+            vel=get_vel(longest)
+        )]
+    elif oscoll == "longest":
+        return [max(grp, key=get_dur)]
+    elif oscoll == "offset":
+        return _str_grp_items(grp)
+    raise ValueError(f"unknown collision {oscoll}")
+
+def _imix(vcs, oscoll):
+    # heap of (onset, order, note/chord, it's voice's iterator)
+    heap = []
+    order = count()
+    def pull(it):
+        x = next(it, None)
+        if x is not None:
+            heapq.heappush(heap, (get_onset(x), next(order), x, it))
+    for vc in vcs:
+        pull(iter(vc))
+    while heap:
+        onset = heap[0][0]
+        grp = []
+        while heap and heap[0][0] == onset:
+            _, _, x, it = heapq.heappop(heap)
+            grp.append(x)
+            if it is not None:
+                pull(it)
+        if len(grp) == 1:
+            yield grp[0]
+            continue
+        first, *rest = _mix_group(grp, oscoll)
+        yield first
+        # offset notes start later, they might collide again
+        for x in rest:
+            heapq.heappush(heap, (get_onset(x), next(order), x, None))
+
 def mix(vcs, oscoll="mix"):
     """Returns a single voice which is a mixture of all voices.
     Collision arg decides what to do if multiple notes/chords
-    overlap, i.e. have the same onset (default is mix: mixing 
-    them to build a single chord. Other args can be...)"""
-    mixed = []
-    concat_vcs = [itm for vc in vcs for itm in vc]
-    for g in _group_by_onset(concat_vcs):
-        if len(g) > 1:
-            if oscoll == "mix":
-                longest = max(g, key=get_dur) # group's longest event
-                mixed.append(chord(
-                    pitches=_pitch_mixture(g),
-                    onset=get_onset(longest),
-                    dur=get_dur(longest),
-                    chnl=get_chnl(longest)+1 if is_note(longest) else get_chnl(longest["notes"][0])+1, # what about
-                    # microtonal???!!!
-                    vel=get_vel(longest)
-                    )
-                )
-        else:
-            mixed.append(g[0])
-    return mixed
+    overlap, i.e. have the same onset: mix (the default) mixes
+    them into a single chord (with the dur, vel and chnl of the
+    longest), longest keeps only the longest one and offset plays
+    them one after another (shortest first), all ending with the
+    longest one (one as long as the note before keeps it's own dur).
+    The voices (lists or generators of notes/chords in onset order)
+    are merged lazily, the mixture is a generator.
+    If any of the voices is a block the mixture is a block too (in
+    a block notes with the same onset already sound as a chord), which
+    only goes with the mix collision."""
+    vcs = list(vcs)
+    if any(is_block(vc) for vc in vcs):
+        if oscoll != "mix":
+            raise ValueError(f"can't mix blocks with collision {oscoll}")
+        return _mix_blocks(vcs)
+    return _imix(vcs, oscoll)
 
 def break_num(n, hi=1):
     """Breaks the number into a list of smaller ints/floats ingredients.
@@ -480,4 +644,5 @@ def nth_rotation(it, nth):
     return chain(islice(it, nth, None), islice(it, 0, nth))
 
 def get_rotations(it, count):
-    return [nth_rotation(it, nth) for nth in range(count)]
+    it = list(it)
+    return [[it[i] for i in idxs] for idxs in milton.seq.rotation_idxs(len(it), count).tolist()]
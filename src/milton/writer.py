@@ -1,51 +1,160 @@
 """
-This file contains abstracts around 
-https://github.com/MarkCWirt/MIDIUtil.git
+Writing Standard Midi Files (format 1): a tempo track followed by
+one track for the free notes/chords and one track per voice/block
+(or one track per port of a compiled timeline).
 """
-import midiutil
+import numpy as np
+import milton.cache
+import milton.timeline
+from milton.tempo import TempoMap
+from milton.utils import _voice_to_block, _split_knums, is_block
 
 
+# ticks per beat, at the default tempo of 60 bpm a beat is one second
+TPB = 960
+_TEMPO = 1_000_000 # microseconds per beat (60 bpm)
+_NOTE_ON = 0x90
+_NOTE_OFF = 0x80
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+# encoded track chunks of voices and blocks, by content
+_chunks = milton.cache.LRU()
 
 
+def _chunk(kind, data):
+    return kind + len(data).to_bytes(4, "big") + data
 
-def save(events, path):
-    # find out number of tracks
-    tracks = {"frei": 0, "voices": 0}
+def _header(ntracks, tpb=TPB):
+    return _chunk(b"MThd", (1).to_bytes(2, "big") + ntracks.to_bytes(2, "big") + tpb.to_bytes(2, "big"))
+
+def _vlq(n):
+    out = bytearray([n & 0x7f])
+    n >>= 7
+    while n:
+        out.insert(0, n & 0x7f | 0x80)
+        n >>= 7
+    return bytes(out)
+
+def _tempo_track(tmap):
+    """Returns the MTrk chunk of the tempo changes of the map."""
+    events = []
+    last = 0
+    for tick, tempo in zip(tmap.ticks.tolist(), tmap.tempos.tolist()):
+        events.append(_vlq(tick - last) + b"\xff\x51\x03" + tempo.to_bytes(3, "big"))
+        last = tick
+    return _chunk(b"MTrk", b"".join(events) + _END_OF_TRACK)
+
+def _get_tempo_map(tempo):
+    """Returns the TempoMap of tempo: a TempoMap, a bpm or a sequence of
+    (time in seconds, bpm) changes, None is 60 bpm."""
+    if tempo is None:
+        return TempoMap([0], [_TEMPO], TPB)
+    if isinstance(tempo, TempoMap):
+        return tempo
+    if np.isscalar(tempo):
+        return TempoMap.from_bpms([0], [tempo], TPB)
+    times, bpms = zip(*tempo)
+    return TempoMap.from_bpms(times, bpms, TPB)
+
+def _encode_events(ticks, status, data1, data2, prefix=b""):
+    """Returns the MTrk chunk of the (tick sorted) channel messages of
+    two data bytes, after the prefix (events with their deltas).
+    Running status leaves out repeated status bytes."""
+    n = len(ticks)
+    deltas = np.diff(ticks, prepend=0)
+    # variable-length quantities of the deltas
+    vlq_len = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    # running status
+    new_status = np.ones(n, dtype=np.int64)
+    new_status[1:] = status[1:] != status[:-1]
+    ev_len = vlq_len + new_status + 2
+    starts = np.cumsum(ev_len) - ev_len
+    buf = np.zeros(int(ev_len.sum()), dtype=np.uint8)
+    for k in range(4):
+        has = vlq_len > k
+        shift = 7 * (vlq_len[has] - 1 - k)
+        cont = np.where(k < vlq_len[has] - 1, 0x80, 0)
+        buf[starts[has] + k] = ((deltas[has] >> shift) & 0x7f) | cont
+    pos = starts + vlq_len
+    buf[pos[new_status == 1]] = status[new_status == 1]
+    pos += new_status
+    buf[pos] = data1
+    buf[pos + 1] = data2
+    return _chunk(b"MTrk", prefix + buf.tobytes() + _END_OF_TRACK)
+
+def _encode_track(blk, tmap):
+    """Returns the MTrk chunk of the block's notes. Note offs are written
+    as note ons with velocity 0, so that running status can leave out
+    most status bytes, and come before note ons of the same tick,
+    except the off of a note lasting no tick, which comes after it's on."""
+    n = len(blk["onset"])
+    on = tmap.to_ticks(blk["onset"])
+    off = tmap.to_ticks(blk["onset"] + blk["dur"])
+    ticks = np.concatenate((on, off))
+    # sort key at the same tick: offs 0, ons 1, offs of zero-tick notes 2
+    is_on = np.concatenate((np.ones(n, dtype=np.int64), 2 * (off == on)))
+    status = np.tile(_NOTE_ON | ((blk["chnl"].astype(np.int64) - 1) % 16), 2)
+    # the key playback sends (the cents are left out), see realtime
+    data1 = np.tile(np.clip(_split_knums(blk["knum"])[0], 0, 127).astype(np.int64), 2)
+    data2 = np.concatenate((np.clip(blk["vel"], 0, 127).astype(np.int64), np.zeros(n, dtype=np.int64)))
+    order = np.lexsort((np.arange(2 * n), is_on, ticks))
+    return _encode_events(ticks[order], status[order], data1[order], data2[order])
+
+def _encode_timeline(tl, tmap):
+    """Returns the MTrk chunks of a timeline.Timeline, one per port
+    (starting with a midi port meta event), with the channels and
+    pitch bends allocated at compile time."""
+    msgs = tl.msgs
+    ticks = tmap.to_ticks(msgs["time"])
+    status = msgs["status"].astype(np.int64)
+    data2 = msgs["data2"].astype(np.int64)
+    # note offs as note ons with velocity 0 (see _encode_track)
+    status[status == _NOTE_OFF] = _NOTE_ON
+    status |= msgs["chnl"]
+    chunks = []
+    for port in np.unique(msgs["port"]).tolist():
+        mask = msgs["port"] == port
+        chunks.append(_encode_events(
+            ticks[mask], status[mask], msgs["data1"][mask].astype(np.int64), data2[mask],
+            prefix=b"\x00\xff\x21\x01" + bytes([port])
+        ))
+    return chunks
+
+
+def _get_tracks(events):
+    """Returns the voices of the tracks: the free notes/chords (if any)
+    first, then every voice as a block."""
+    frei = []
+    voices = []
     for e in events:
         try:
-            if e["type"] == "note" or e["type"] == "chord":
+            if is_block(e):
+                voices.append(e)
+            elif e["type"] == "note" or e["type"] == "chord":
                 # frei rumliegende Noten/Akkorde gehen inselben Track
-                if tracks["frei"] == 0:
-                    tracks["frei"] = 1
-        except TypeError:
-            tracks["voices"] += 1
-    tracks_count = sum(tracks.values())
-    file_obj = midiutil.MIDIFile(tracks_count, deinterleave=False)
-    for i in range(tracks_count):
-        file_obj.addTempo(i, 0, 60)
-    vidx=0
-    for e in events:
-        try:
-            if e["type"] == "note":
-                file_obj.addNote(0, e["chnl"], e["non"][1],
-                                 e["onset"], e["dur"], e["non"][2])
-            elif e["type"] == "chord":
-                for x in e["notes"]:
-                    file_obj.addNote(0, x["chnl"], x["non"][1],
-                                     x["onset"], x["dur"], x["non"][2])
+                frei.append(e)
         except TypeError:
-            for x in e:
-                if x["type"] == "note":
-                    file_obj.addNote(vidx, x["chnl"], x["non"][1],
-                                     x["onset"], x["dur"], x["non"][2],
-                                    )
-                elif x["type"] == "chord":
-                    for y in x["notes"]:
-                        file_obj.addNote(vidx,y["chnl"], y["non"][1],
-                                     y["onset"], y["dur"], y["non"][2]
-                                        )
-                else:
-                    raise ValueError("Error aus cumidiutil.py")
-            vidx+=1
+            voices.append(_voice_to_block(e))
+    return ([frei] if frei else []) + voices
+
+
+def save(events, path, tempo=None):
+    """Writes the events to the midi file at path. A compiled
+    timeline.Timeline is written with one track per port, including
+    it's pitch bends, otherwise every voice gets a track.
+    tempo (a tempo.TempoMap, a bpm or a sequence of (time in seconds,
+    bpm) changes, default 60 bpm) is written to the tempo track, the
+    notes keep their times in seconds."""
+    tmap = _get_tempo_map(tempo)
+    if isinstance(events, milton.timeline.Timeline):
+        chunks = [_tempo_track(tmap)] + _encode_timeline(events, tmap)
+    else:
+        if isinstance(events, dict): # a single block, note or chord
+            events = [events]
+        events = list(events) # might be a generator
+        # unchanged voices are encoded only once (per tempo map)
+        chunks = [_tempo_track(tmap)] + [
+            milton.cache.compiled(_chunks, vc, lambda blk: _encode_track(blk, tmap), tmap.key)
+            for vc in _get_tracks(events)
+        ]
     with open(path, "wb") as midfile:
-        file_obj.writeFile(midfile)
+        midfile.write(_header(len(chunks), tmap.tpb) + b"".join(chunks))
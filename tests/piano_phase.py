@@ -1,7 +1,7 @@
-import cu
+import milton
 
 
-cu.open_ports()
+milton.realtime.init()
 
 # helper functions and Piano 1
 phasing_trope = (64, 66, 71, 73, 74, 66, 64, 73, 71, 66, 74, 73)
@@ -11,7 +11,7 @@ phasing_tempo = 72
 def piano1(trope, stay, move, amp, chan):
     tlen = len(trope)
     cycs = tlen
-    rate = cu.rhy_to_sec(phasing_pulse, phasing_tempo)
+    rate = milton.rhy_to_sec(phasing_pulse, phasing_tempo)
     notes = []
     repeat = tlen * (stay + move) * cycs
     coda = stay * tlen
@@ -20,7 +20,7 @@ def piano1(trope, stay, move, amp, chan):
     while reps:
         x = i % tlen
         k = trope[x]
-        notes.append(cu.note(onset=cu.pret(rate*i), knum=k, 
+        notes.append(milton.make_note(onset=milton.pret(rate*i), pch=k, 
                             dur=rate * 1.5, vel=amp,
                             chnl=chan))
         i += 1
@@ -38,9 +38,9 @@ def piano2(trope, stay, move, amp, chan):
     tlen = len(trope)
     cycs = tlen
     coda = stay * tlen
-    curve = cu.pret(phasing_tempo_curve(tlen, stay, move))
+    curve = milton.pret(phasing_tempo_curve(tlen, stay, move))
     clen = len(curve)
-    rate = cu.rhy_to_sec(phasing_pulse, phasing_tempo)
+    rate = milton.rhy_to_sec(phasing_pulse, phasing_tempo)
     repeat = clen * cycs + coda
     i = 0
     notes = []
@@ -49,8 +49,8 @@ def piano2(trope, stay, move, amp, chan):
         k = trope[i % tlen]
         c = curve[i % clen]
         notes.append(
-            cu.note(
-                knum=k, onset=(o),
+            milton.make_note(
+                pch=k, onset=(o),
                 dur=rate * 1.5, vel=amp, chnl=chan
             )
         )
@@ -63,8 +63,8 @@ def pphase(trope, stay, move, amp):
     return piano1(trope, stay, move, amp, 1), \
             piano2(trope, stay, move, amp, 2)
 
-cu.proc(
+milton.proc(
     pphase(phasing_trope, 1, 20, 100),
-    write to midi
+    # write to midi
     "/tmp/pphase.mid"
 )
@@ -1,5 +1,5 @@
 from math import log2
-import computil as cu
+import milton
 
 first_interval = 4 # in seconds
 K = first_interval / log2(9 / 8)
@@ -12,13 +12,13 @@ def duration(n):
 #     os.append(x)
 #     x += duration(n)
 #
-cu.cfg.port_count = 4
-cu.open_ports()
+milton.cfg.port_count = 4
+milton.realtime.init()
 # ns=[]
-# for o, d in zip(os, cu.get_onset_durs(os)):
-#     ns.append(cu.note(knum=33, onset=o, dur=d))
+# for o, d in zip(os, milton.get_onset_durs(os)):
+#     ns.append(milton.note(knum=33, onset=o, dur=d))
 #
-# # cu.proc(ns)
+# # milton.proc(ns)
 
 
 # for i in range(1, 23*8+1):
@@ -45,7 +45,7 @@ for i in range(len(os[:3])):
     hz *= (i + 1)
     for j, o in enumerate(os[:3][i]):
         # breakpoint()
-        v.append(cu.note(onset=o, dur=.1, chnl=i+1, knum=cu.hz_to_knum(hz)))
+        v.append(milton.make_note(onset=o, dur=.1, chnl=i+1, pch=milton.hz_to_knum(hz)))
     vs.append(v)
 
 # print(vs)
@@ -53,4 +53,4 @@ for i in range(len(os[:3])):
 # print(K*log2(1), K*log2(2), K*log2(3))
 # print(K*log2(2)==K)
 
-cu.proc(*vs)
+milton.proc(vs)
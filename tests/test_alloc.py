@@ -0,0 +1,47 @@
+import pytest
+import milton.err
+from milton.alloc import ChnlAllocator
+
+
+def test_microtones_get_channels_of_their_own():
+    chnls = ChnlAllocator(4)
+    assert chnls.acquire_micton(2) == 2 # taken directly, stays in the heap
+    assert chnls.acquire_micton(2) == 0
+    assert chnls.acquire_micton(0) == 1
+    # 2 comes up in the heap but is in use
+    assert chnls.acquire_micton(1) == 3
+    with pytest.raises(milton.err.NoFreeChnlErr):
+        chnls.acquire_micton(3)
+
+def test_released_channels_go_back_to_the_heap():
+    chnls = ChnlAllocator(3)
+    assert [chnls.acquire_micton(0) for _ in range(3)] == [0, 1, 2]
+    chnls.release(1)
+    assert chnls.occupancy() == {0: (1, True), 2: (1, True)}
+    assert chnls.acquire_micton(0) == 1
+    with pytest.raises(milton.err.NoFreeChnlErr):
+        chnls.acquire_micton(0)
+
+def test_direct_channels_are_not_pushed_twice():
+    chnls = ChnlAllocator(3)
+    for _ in range(5):
+        chnls.release(chnls.acquire_micton(1))
+        chnls.release(chnls.acquire_eqtemp(2))
+    assert sorted(chnls._free) == [0, 1, 2]
+    assert chnls.occupancy() == {}
+
+def test_equal_tempered_notes_share_channels():
+    chnls = ChnlAllocator(3)
+    assert chnls.acquire_eqtemp(0) == 0
+    assert chnls.acquire_eqtemp(0) == 0
+    # a microtone doesn't go where equal-tempered notes are
+    assert chnls.acquire_micton(0) == 1
+    # and equal-tempered notes don't go to a microtone's channel
+    assert chnls.acquire_eqtemp(1) == 0
+    assert chnls.occupancy() == {0: (3, False), 1: (1, True)}
+    for _ in range(3):
+        chnls.release(0)
+    assert chnls.occupancy() == {1: (1, True)}
+    chnls.release(1)
+    # all free again, the microtone's channel was popped and is back
+    assert [chnls.acquire_micton(2) for _ in range(3)] == [2, 0, 1]
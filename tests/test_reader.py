@@ -0,0 +1,135 @@
+import numpy as np
+import milton
+from milton import reader, writer
+from milton.utils import make_notes
+
+
+def _vlq(n):
+    out = [n & 0x7f]
+    n >>= 7
+    while n:
+        out.insert(0, n & 0x7f | 0x80)
+        n >>= 7
+    return bytes(out)
+
+def _smf(tmp_path, *tracks, tpb=960):
+    """Writes a midi file of the tracks (lists of (delta, event bytes))."""
+    data = b"MThd" + (6).to_bytes(4, "big") + (1).to_bytes(2, "big") \
+        + len(tracks).to_bytes(2, "big") + tpb.to_bytes(2, "big")
+    for events in tracks:
+        body = b"".join(_vlq(delta) + ev for delta, ev in events) + b"\x00\xff\x2f\x00"
+        data += b"MTrk" + len(body).to_bytes(4, "big") + body
+    path = tmp_path / "t.mid"
+    path.write_bytes(data)
+    return str(path)
+
+def _notes(blk):
+    return list(zip(blk["onset"].tolist(), blk["dur"].tolist(), blk["knum"].tolist(),
+                    blk["vel"].tolist(), blk["chnl"].tolist()))
+
+def _assert_notes(got, want):
+    np.testing.assert_allclose(np.array(got, dtype=float).reshape(-1, 5),
+                               np.array(want, dtype=float).reshape(-1, 5), atol=1e-9)
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 500
+    # on the tick grid (960 ticks a second at the writer's 60 bpm),
+    # one note per channel and key
+    i = np.arange(n)
+    blk = make_notes(21 + i % 88, rng.integers(0, 20000, n) / 960,
+                     rng.integers(1, 2000, n) / 960, 1 + i // 88, rng.integers(1, 128, n))
+    path = str(tmp_path / "rt.mid")
+    writer.save([blk], path)
+    tracks = [t for t in reader.parse(path) if len(t["onset"])]
+    assert len(tracks) == 1
+    got = tracks[0]
+    want = sorted(_notes(blk))
+    _assert_notes(sorted(_notes(got)), want)
+
+def test_overlapping_notes_of_a_key(tmp_path):
+    path = _smf(tmp_path, [
+        (0, b"\x90\x3c\x40"), (100, b"\x90\x3c\x50"),
+        (100, b"\x80\x3c\x00"), (100, b"\x80\x3c\x00"),
+    ])
+    # first in first out, at 120 bpm (no tempo event) a tick is 1/1920 s
+    _assert_notes(_notes(reader.parse(path)[0]), [
+        (0, 200 / 1920, 60, 64, 1), (100 / 1920, 200 / 1920, 60, 80, 1),
+    ])
+
+def test_velocity_zero_is_note_off(tmp_path):
+    path = _smf(tmp_path, [
+        (0, b"\x91\x40\x64"), (480, b"\x91\x40\x00"), (0, b"\x91\x40\x64"), (480, b"\x91\x40\x00"),
+    ], tpb=480)
+    _assert_notes(_notes(reader.parse(path)[0]), [
+        (0, 0.5, 64, 100, 2), (0.5, 0.5, 64, 100, 2),
+    ])
+
+def test_off_before_on(tmp_path):
+    # a stray off is dropped, a note without an off ends with the track
+    path = _smf(tmp_path, [
+        (0, b"\x80\x3c\x00"), (480, b"\x90\x3c\x40"), (480, b"\x80\x3c\x00"),
+        (0, b"\x90\x3e\x40"), (960, b"\xb0\x07\x64"),
+    ], tpb=480)
+    _assert_notes(_notes(reader.parse(path)[0]), [
+        (0.5, 0.5, 60, 64, 1), (1.0, 1.0, 62, 64, 1),
+    ])
+
+def test_running_status_between_other_events(tmp_path):
+    path = _smf(tmp_path, [
+        (0, b"\xff\x03\x04name"),
+        (0, b"\xc0\x05"), (0, b"\x07"), # program change, then running status
+        (0, b"\x90\x3c\x40"), (0, b"\x3e\x40"), # note ons with running status
+        (10, b"\xf0\x03\x7e\x00\xf7"), # sysex
+        (10, b"\x90\x3c\x00"), (0, b"\x3e\x00"),
+        (0, b"\xd0\x10"), # channel pressure
+        (0, b"\xe0\x00\x40"), # pitch bend
+        (0, b"\xff\x01\x02hi"),
+        (20, b"\x92\x43\x30"), (0, b"\xb2\x07\x64"), (0, b"\x0a\x40"), (40, b"\x92\x43\x00"),
+    ], tpb=480)
+    sec = 1 / 960
+    _assert_notes(_notes(reader.parse(path)[0]), [
+        (0, 20 * sec, 60, 64, 1), (0, 20 * sec, 62, 64, 1), (40 * sec, 40 * sec, 67, 48, 3),
+    ])
+
+def test_tempo_changes(tmp_path):
+    path = _smf(tmp_path, [
+        (0, b"\xff\x51\x03" + (500_000).to_bytes(3, "big")),
+        (960, b"\xff\x51\x03" + (1_000_000).to_bytes(3, "big")),
+    ], [
+        (480, b"\x90\x3c\x40"), (960, b"\x80\x3c\x00"), (0, b"\x90\x3e\x40"), (480, b"\x80\x3e\x00"),
+    ], tpb=480)
+    # 1 s a beat from tick 960 (1 s) on, 0.5 s before
+    _assert_notes(_notes(reader.parse(path)[1]), [
+        (0.5, 1.5, 60, 64, 1), (2.0, 1.0, 62, 64, 1),
+    ])
+
+def test_tempo_curve_round_trip(tmp_path):
+    onsets = np.arange(200) * 0.25
+    blk = make_notes(60 + np.arange(200) % 12, onsets, 0.2)
+    times = np.arange(50.0)
+    path = str(tmp_path / "tempo.mid")
+    writer.save([blk], path, tempo=list(zip(times, 60 + 30 * np.sin(times / 5))))
+    got = [t for t in reader.parse(path) if len(t["onset"])][0]
+    # whole ticks at up to 90 bpm are at most 1/1440 s off
+    assert np.abs(got["onset"] - onsets).max() < 1e-3
+    assert np.abs(got["dur"] - 0.2).max() < 2e-3
+
+def test_parse_many_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(milton.cfg, "cache_dir", str(tmp_path / "cache"))
+    path = str(tmp_path / "c.mid")
+    blk = make_notes([60, 64, 67], [0, 0.5, 1], 0.5)
+    writer.save([blk], path)
+    cold = reader.parse_many([path], processes=1)
+    warm = reader.parse_many([path], processes=1)
+    assert [_notes(t) for t in warm[0]] == [_notes(t) for t in cold[0]]
+    _assert_notes(_notes(warm[0][1]), _notes(blk))
+
+def test_microtonal_keys_round_like_playback(tmp_path):
+    # cents round to the nearest, 99.7 cents up to the next key
+    blk = make_notes([60.997, 61.4, 61.6, 3.999999999999986], [0, 1, 2, 3], 0.5)
+    path = str(tmp_path / "mt.mid")
+    writer.save([blk], path)
+    got = [t for t in reader.parse(path) if len(t["onset"])][0]
+    assert got["knum"].tolist() == [61, 61, 61, 4]
@@ -0,0 +1,71 @@
+import asyncio
+import milton.realtime as realtime
+from milton.utils import make_note
+
+
+def _note_ons(session):
+    msgs = session.backend.records()["msg"]
+    return msgs[(msgs[:, 0] & 0xf0 == 0x90) & (msgs[:, 2] > 0)]
+
+def test_loop_with_an_empty_voice():
+    session = realtime.Session("capture")
+    events = [[make_note(60, 2.2, 0.3)], [make_note(62, 5, 1)]]
+    async def run():
+        task = asyncio.ensure_future(realtime.play(events, False, start=2, end=3, loop=True,
+                                                   session=session))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    asyncio.run(run())
+    assert _note_ons(session)[:, 1].tolist() == [60]
+
+def test_a_waiting_async_stream_doesnt_hold_up_the_others():
+    session = realtime.Session("capture")
+    async def slow():
+        await asyncio.sleep(0.5)
+        yield make_note(70, 0.5, 0.1)
+    async def run():
+        start = session.clock()
+        await realtime.play([[make_note(60, 0, 0.2)], slow()], False, session=session, at=start)
+        return start
+    start = asyncio.run(run())
+    recs = session.backend.records()
+    times = {tuple(m): t - start for m, t in zip(recs["msg"].tolist(), recs["time"])}
+    # the off of 60 isn't held back until 70 arrives
+    assert times[(0x80, 60, 0)] < 0.3
+    assert 0.5 <= times[(0x90, 70, 127)] < 0.6
+
+def test_cancelling_aplay():
+    import milton
+    session = realtime.Session("capture")
+    async def run():
+        task = asyncio.ensure_future(milton.aplay([make_note(60, 0, 5)], session=session))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert task.cancelled()
+        try:
+            await asyncio.wait_for(milton.aplay([make_note(60, 0, 5)], session=session), 0.1)
+        except asyncio.TimeoutError:
+            return True
+    assert asyncio.run(run())
+    msgs = session.backend.records()["msg"]
+    # all sound off on every channel
+    assert ((msgs[:, 0] & 0xf0 == 0xb0) & (msgs[:, 1] == 0x78)).sum() == 2 * 16
+
+def test_sender_lags_are_reported(monkeypatch):
+    import milton.cfg
+    import milton.telemetry
+    monkeypatch.setattr(milton.cfg, "sender_thread", True)
+    session = realtime.Session("capture")
+    tele = milton.telemetry.Telemetry(session.client_ports(), synths=session.client_synths())
+    asyncio.run(realtime.play([make_note(60, 0, 0.05)], False, telemetry=tele, session=session))
+    lags = tele.report()["sender_lag"]
+    assert set(lags) == set(milton.cfg.synths)
+    assert all(0 <= lag < 0.1 for lag in lags.values())